@@ -0,0 +1,379 @@
+import io
+import itertools
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional: sealed segments stay plain JSONL without it
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: locking is per-process only
+    fcntl = None
+
+STORE_VERSION = 1
+
+
+class DocumentStore:
+    """
+    Append-only document store: sealed JSONL segments + a write-ahead tail.
+
+    Layout of `root`:
+      - manifest.json            committed list of sealed segments (the commit point)
+      - seg-000001.jsonl[.zst]   immutable segments, in document order
+      - wal.jsonl                active tail; every append is written + fsynced here
+      - LOCK                     flock()ed by writers so several processes can append
+
+    Appending a document costs O(document). When the tail reaches `seal_every` docs it is
+    sealed into a (zstd-compressed, if available) segment, and once there are more than
+    `max_segments` segments adjacent ones are merged, so compaction cost stays amortized.
+    Document order is preserved by sealing and compaction, which keeps doc ids stable.
+    """
+
+    def __init__(self, root: str, seal_every: int = 5000, max_segments: int = 16, compress: bool = True):
+        self.root = root
+        self.seal_every = seal_every
+        self.max_segments = max_segments
+        self.compress = compress and zstandard is not None
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._disk_state = None   # manifest/tail stamps as of our last release of the LOCK
+        os.makedirs(root, exist_ok=True)
+        with self._locked():
+            self._recover()
+
+    # ---------------------- paths + locking ----------------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    @property
+    def _wal_path(self) -> str:
+        return self._path("wal.jsonl")
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            # flock() is per open file, so only the outermost (re-entrant) acquisition takes it
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self._path("LOCK"), "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    # Another process appended/sealed since we last held the lock: reload its state
+                    if self._disk_state is not None and self._stat_disk() != self._disk_state:
+                        self._recover()
+                    yield
+                finally:
+                    self._disk_state = self._stat_disk()
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _stat_disk(self):
+        stamps = []
+        for path in (self._path("manifest.json"), self._wal_path):
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    # ---------------------- manifest ----------------------
+    def _read_manifest(self) -> Dict[str, Any]:
+        path = self._path("manifest.json")
+        if not os.path.exists(path):
+            return {"version": STORE_VERSION, "store_id": uuid.uuid4().hex, "next_segment": 1,
+                    "segments": [], "imports": {}}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp = self._path("manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path("manifest.json"))
+        self.manifest = manifest
+
+    # ---------------------- recovery ----------------------
+    def _recover(self):
+        """Bring the directory back to a consistent state after a crash (called under lock)."""
+        self.manifest = self._read_manifest()
+        if not os.path.exists(self._path("manifest.json")):
+            self._write_manifest(self.manifest)
+
+        # An interrupted seal (<segment>.sealing): finish it unless the manifest already committed it
+        committed = {s["name"] for s in self.manifest["segments"]}
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".sealing"):
+                if name[:-len(".sealing")] in committed:
+                    os.remove(self._path(name))
+                else:
+                    self._seal_file(self._path(name), name[:-len(".sealing")])
+
+        # Segments written but never committed (crash before the manifest swap)
+        committed = {s["name"] for s in self.manifest["segments"]}
+        for name in os.listdir(self.root):
+            if name.startswith("seg-") and name not in committed and not name.endswith(".sealing"):
+                os.remove(self._path(name))
+
+        # Torn last line in the tail (crash mid-append): cut it off
+        self.wal_docs = 0
+        if os.path.exists(self._wal_path):
+            good = 0
+            with open(self._wal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        json.loads(line)
+                    except ValueError:
+                        break
+                    good += len(line)
+                    self.wal_docs += 1
+            if good != os.path.getsize(self._wal_path):
+                print(f"⚠️ Document store: truncating torn write-ahead tail at byte {good}")
+                with open(self._wal_path, "r+b") as f:
+                    f.truncate(good)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the store lock across several calls (e.g. index the tail, then replace()), so no other
+        process appends in between. Entering picks up whatever other processes wrote before.
+        """
+        with self._locked():
+            yield self
+
+    def refresh(self):
+        """
+        Re-read state written by other processes (enricher scripts appending to the same store).
+        Taking the lock already reloads it when the manifest or tail changed on disk, so polling an
+        idle store costs two stat() calls instead of re-parsing the tail.
+        """
+        with self._locked():
+            pass
+
+    # ---------------------- writes ----------------------
+    def append(self, docs: List[Dict[str, Any]]) -> int:
+        """
+        Durably append docs to the tail and return the position of the first one (other processes
+        may have appended since this one last looked). Cost is O(len(docs)), independent of corpus size.
+        """
+        if not docs:
+            return len(self)
+        payload = b"".join(
+            json.dumps({"text": d.get("text", ""), "source": d.get("source", "")}, ensure_ascii=False).encode("utf-8")
+            + b"\n"
+            for d in docs
+        )
+        with self._locked():
+            start = len(self)
+            with open(self._wal_path, "ab") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            self.wal_docs += len(docs)
+            if self.wal_docs >= self.seal_every:
+                self._seal()
+        return start
+
+    def _seal(self):
+        """Turn the tail into an immutable segment (called under lock)."""
+        name = self._segment_name(self.manifest)
+        sealing = self._path(name + ".sealing")
+        os.replace(self._wal_path, sealing)
+        self.wal_docs = 0
+        self._seal_file(sealing, name)
+        if len(self.manifest["segments"]) > self.max_segments:
+            self.compact()
+
+    def _seal_file(self, path: str, name: str):
+        with open(path, "rb") as f:
+            count = self._write_segment(name, (line for line in f if line.strip()))
+        manifest = dict(self.manifest)
+        manifest["next_segment"] = max(manifest["next_segment"], int(name[4:10]) + 1)
+        manifest["segments"] = self.manifest["segments"] + [{"name": name, "docs": count}]
+        self._write_manifest(manifest)
+        os.remove(path)
+
+    def _segment_name(self, manifest: Dict[str, Any]) -> str:
+        return f"seg-{manifest['next_segment']:06d}.jsonl" + (".zst" if self.compress else "")
+
+    def _write_segment(self, name: str, lines) -> int:
+        tmp = self._path(name + ".tmp")
+        count = 0
+        with open(tmp, "wb") as raw:
+            out = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False) if name.endswith(".zst") else raw
+            for line in lines:
+                out.write(line if line.endswith(b"\n") else line + b"\n")
+                count += 1
+            if out is not raw:
+                out.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, self._path(name))
+        return count
+
+    def compact(self, max_segments: Optional[int] = None):
+        """Merge adjacent segments (smallest neighbouring pair first) until at most `max_segments` remain."""
+        limit = self.max_segments if max_segments is None else max_segments
+        with self._locked():
+            while len(self.manifest["segments"]) > max(limit, 1):
+                segs = self.manifest["segments"]
+                i = min(range(len(segs) - 1), key=lambda j: segs[j]["docs"] + segs[j + 1]["docs"])
+                manifest = dict(self.manifest)
+                name = self._segment_name(manifest)
+                manifest["next_segment"] += 1
+                count = self._write_segment(name, itertools.chain(self._iter_segment_lines(segs[i]),
+                                                                  self._iter_segment_lines(segs[i + 1])))
+                manifest["segments"] = segs[:i] + [{"name": name, "docs": count}] + segs[i + 2:]
+                self._write_manifest(manifest)
+                for old in (segs[i], segs[i + 1]):
+                    os.remove(self._path(old["name"]))
+
+    def replace(self, docs: List[Dict[str, Any]]) -> int:
+        """
+        Atomically replace the whole content with `docs` (e.g. after removing docs, which renumbers
+        them). The store gets a new store_id, so bundles of the old content are no longer a prefix.
+        """
+        with self._locked():
+            if os.path.exists(self._wal_path):
+                # Make the tail a committed segment first; the manifest swap below then drops it
+                # together with the old segments (crash before the swap: old content stays intact)
+                name = self._segment_name(self.manifest)
+                os.replace(self._wal_path, self._path(name + ".sealing"))
+                self.wal_docs = 0
+                self._seal_file(self._path(name + ".sealing"), name)
+            old_segments = self.manifest["segments"]
+            manifest = dict(self.manifest)
+            name = self._segment_name(manifest)
+            manifest["next_segment"] += 1
+            manifest["store_id"] = uuid.uuid4().hex
+            count = self._write_segment(name, (
+                json.dumps({"text": d.get("text", ""), "source": d.get("source", "")}, ensure_ascii=False).encode("utf-8")
+                + b"\n"
+                for d in docs
+            ))
+            manifest["segments"] = [{"name": name, "docs": count}]
+            self._write_manifest(manifest)
+            for seg in old_segments:
+                os.remove(self._path(seg["name"]))
+        return count
+
+    def _iter_segment_lines(self, seg: Dict[str, Any]) -> Iterator[bytes]:
+        with self._open_segment(seg["name"]) as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+    def _open_segment(self, name: str):
+        raw = open(self._path(name), "rb")
+        if name.endswith(".zst"):
+            if zstandard is None:
+                raw.close()
+                raise RuntimeError(f"{name} is zstd-compressed but the `zstandard` package is not installed")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+        return raw
+
+    # ---------------------- reads ----------------------
+    def __len__(self) -> int:
+        return sum(s["docs"] for s in self.manifest["segments"]) + self.wal_docs
+
+    def iter_docs(self, start: int = 0) -> Iterator[Dict[str, Any]]:
+        """Stream docs in order from position `start`; sees a consistent snapshot taken on entry."""
+        with self._locked():
+            handles = []
+            skip = start
+            for seg in self.manifest["segments"]:
+                if not handles and skip >= seg["docs"]:
+                    skip -= seg["docs"]
+                    continue
+                handles.append(self._open_segment(seg["name"]))
+            wal_size = os.path.getsize(self._wal_path) if os.path.exists(self._wal_path) else 0
+            wal = open(self._wal_path, "rb") if wal_size else None
+
+        # Open handles survive concurrent seals/compactions (POSIX unlink semantics)
+        try:
+            for f in handles:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    if skip:
+                        skip -= 1
+                        continue
+                    yield json.loads(line)
+            if wal is not None:
+                for line in io.BytesIO(wal.read(wal_size)):
+                    if skip:
+                        skip -= 1
+                        continue
+                    yield json.loads(line)
+        finally:
+            for f in handles:
+                f.close()
+            if wal is not None:
+                wal.close()
+
+    def fingerprint(self) -> Dict[str, Any]:
+        """Identity + size; a bundle built at `docs` is a valid prefix of any later state of the same store."""
+        return {"store_id": self.manifest["store_id"], "docs": len(self)}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "docs": len(self),
+            "segments": len(self.manifest["segments"]),
+            "tail_docs": self.wal_docs,
+            "compressed": self.compress,
+        }
+
+    # ---------------------- legacy import ----------------------
+    def import_json(self, path: str, known_hashes=None, text_hash=None) -> List[Dict[str, Any]]:
+        """
+        Import a legacy knowledge.json (list of {text, source}) if it changed since the last import.
+        Docs whose hash is already in `known_hashes` are skipped. Returns the appended docs.
+        """
+        if not os.path.exists(path):
+            return []
+        st = os.stat(path)
+        stamp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        key = os.path.abspath(path)
+        if self.manifest.get("imports", {}).get(key) == stamp:
+            return []
+
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        fresh = []
+        seen = set()
+        for it in items:
+            t, s = it.get("text", ""), it.get("source", "")
+            if not t or not s:
+                continue
+            if known_hashes is not None and text_hash is not None:
+                h = text_hash(t)
+                if h in known_hashes or h in seen:
+                    continue
+                seen.add(h)
+            fresh.append({"text": t, "source": s})
+
+        for i in range(0, len(fresh), self.seal_every):
+            self.append(fresh[i:i + self.seal_every])
+        with self._locked():
+            manifest = dict(self.manifest)
+            manifest["imports"] = {**manifest.get("imports", {}), key: stamp}
+            self._write_manifest(manifest)
+        print(f"📥 Imported {len(fresh)} docs from {path} into the document store")
+        return fresh
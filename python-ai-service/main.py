@@ -1,6 +1,7 @@
 
 # ====================== CORE IMPORTS ======================
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 # FastAPI for HTTP endpoints + background tasks
 
 from pydantic import BaseModel
@@ -22,18 +23,37 @@ from datasets import load_dataset
 # - requests + bs4 for Wikipedia/StackExchange
 # - datasets for Hugging Face streaming
 
-import json, os, time, re, hashlib, difflib
+import json, os, time, re, hashlib, difflib, threading, bisect, shutil, sys, queue, uuid, gzip, io
 # Built-in utilities + hashing + fuzzy matching
 
-from typing import List, Dict, Optional, Any
-from collections import defaultdict
+from doc_store import DocumentStore
+# Append-only segmented document store (replaces whole-file knowledge.json rewrites)
 
+from typing import List, Dict, Optional, Any, Tuple, Iterable, Iterator
+from collections import Counter, OrderedDict, deque
+from array import array
+import heapq, itertools, math, asyncio
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+
+try:
+    import fcntl
+except ImportError:  # Windows: the embedding cache is then safe for one process only
+    fcntl = None
 
-app = FastAPI()
-# Creates the FastAPI application instance
 
 KNOWLEDGE_PATH = "knowledge.json"
-# Path to your knowledge database file
+# Legacy knowledge file: imported into the document store whenever it changes (dedup by text hash)
+
+KNOWLEDGE_STORE_DIR = os.environ.get("KNOWLEDGE_STORE_DIR", "knowledge_store")
+KNOWLEDGE_STORE_COMPRESS = os.environ.get("KNOWLEDGE_STORE_COMPRESS", "1") == "1"
+# Segmented store that live fallbacks append to (zstd-compressed segments if `zstandard` is installed)
+
+EMBED_MODEL_NAME = "multi-qa-mpnet-base-dot-v1"
+# EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+
+INDEX_BUNDLE_DIR = os.environ.get("INDEX_BUNDLE_DIR", "index_bundle")
+# Prebuilt, memory-mapped indexes (see `python main.py build-index`)
 
 
 
@@ -54,22 +74,6 @@ HTTP.headers.update(REQUEST_HEADERS)
 
 
 # ====================== LOAD AND INDEX KNOWLEDGE ======================
-print("🚀 Loading knowledge base...")
-if not os.path.exists(KNOWLEDGE_PATH):
-    raise FileNotFoundError(f"Knowledge file not found: {KNOWLEDGE_PATH}")
-
-with open(KNOWLEDGE_PATH, "r", encoding="utf-8") as f:
-    docs = json.load(f)
-# Reads the entire knowledge.json into memory
-# Each entry: {"text": "...", "source": "..."}
-
-print(f"✅ Loaded {len(docs)} knowledge entries")
-
-# Create multiple indexes for better matching
-keyword_index = defaultdict(list)  # word -> list of doc indices
-source_index = {}                  # source -> doc
-topic_index = {}                   # clean topic -> doc
-
 # ---------------------- PATCH: Topic extraction from source ----------------------
 def _extract_topic_from_source(src: str) -> str:
     """
@@ -101,43 +105,1603 @@ def _extract_topic_from_source(src: str) -> str:
     return s.replace("-", " ").strip()
 # -------------------------------------------------------------------------------
 
-for idx, doc in enumerate(docs):
-    # Index by source
-    source = doc.get("source", "").lower()
-    source_index[source] = doc
 
-    # PATCH: Use improved topic extraction for all sources
-    clean_topic = _extract_topic_from_source(source)
-    if clean_topic:
-        topic_index[clean_topic] = doc
+# ====================== KEYWORD INDEX (BM25) ======================
+BM25_K1 = 1.2
+BM25_B = 0.75
+KEYWORD_TOP_K = 10
+
+KEYWORD_POSTINGS_COMPRESS = os.environ.get("KEYWORD_POSTINGS_COMPRESS", "0") == "1"
+# Delta + varint encode the merged postings (~1-2 bytes/posting instead of 6; decoded per query term)
+
+KEYWORD_TAIL_MIN_MERGE = 200_000
+KEYWORD_TAIL_MERGE_RATIO = 0.1
+# The mutable tail is merged into the CSR base once it holds more than
+# max(KEYWORD_TAIL_MIN_MERGE, KEYWORD_TAIL_MERGE_RATIO * base postings) postings (amortized O(1) per posting)
+
+def _keyword_tokens(text: str) -> List[str]:
+    """Indexed tokens of a text: lowercase words longer than 3 chars, repeats kept for tf."""
+    return [w for w in re.findall(r'\b\w+\b', (text or "").lower()) if len(w) > 3]
+
+def _varint_encode(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """LEB128-encode non-negative ints. Returns (bytes, encoded size of each value)."""
+    v = np.asarray(values, dtype="uint64")
+    sizes = np.ones(len(v), dtype="int64")
+    for shift in (7, 14, 21, 28, 35):
+        sizes += v >= (1 << shift)
+    out = np.zeros(int(sizes.sum()), dtype="uint8")
+    starts = np.cumsum(sizes) - sizes
+    for k in range(int(sizes.max()) if len(v) else 0):
+        has = sizes > k
+        byte = (v[has] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (sizes[has] > k + 1).astype("uint64") << np.uint64(7)
+        out[starts[has] + k] = (byte | more).astype("uint8")
+    return out, sizes
+
+def _varint_decode(buf: np.ndarray) -> np.ndarray:
+    """Inverse of _varint_encode (vectorized)."""
+    b = np.asarray(buf, dtype="uint8")
+    if not len(b):
+        return np.zeros(0, dtype="int64")
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = (np.arange(len(b)) - np.repeat(starts, ends - starts + 1)) * 7
+    return np.add.reduceat((b & 0x7F).astype("int64") << shifts, starts)
+
+class KeywordIndex:
+    """
+    Inverted index ranked with BM25, stored CSR-style.
+    - Base: one vocabulary blob (sorted), per-term offsets and a single doc-id buffer (uint32,
+      or delta+varint bytes) with parallel term frequencies. Comes from the index bundle
+      (memmapped) or from merging the tail; either way there is no per-posting Python object.
+    - Tail: small mutable array('I')/array('H') postings for docs added since the last merge.
+    - Document lengths and per-term IDF, max tf and shortest doc give each term a score
+      upper bound, which top-k search uses to probe weak terms instead of merging them (MaxScore).
+    """
+
+    def __init__(self):
+        self.base = None                      # CSR arrays (see merge_tail / load)
+        self.base_doc_lens = np.zeros(0, dtype="uint32")
+        self.terms: Dict[str, Tuple[array, array]] = {}
+        self.term_max_tf: Dict[str, int] = {}
+        self.term_min_dl: Dict[str, int] = {}
+        self.doc_lens = array("I")            # lengths of docs after the base
+        self.tail_postings = 0
+        self.total_len = 0
+        self.auto_merge = True
+        self._idf: Dict[str, Tuple[int, float]] = {}
+
+    # ---------------------- building ----------------------
+    def add_document(self, doc_id: int, text: str):
+        if doc_id != self.n_docs:
+            raise ValueError(f"documents must be added in order (expected id {self.n_docs}, got {doc_id})")
+        counts = Counter(_keyword_tokens(text))
+        dl = sum(counts.values())
+        self.doc_lens.append(dl)
+        self.total_len += dl
+        for term, tf in counts.items():
+            entry = self.terms.get(term)
+            if entry is None:
+                entry = self.terms[term] = (array("I"), array("H"))
+            entry[0].append(doc_id)
+            entry[1].append(min(tf, 0xFFFF))
+            self.term_max_tf[term] = max(self.term_max_tf.get(term, 0), tf)
+            self.term_min_dl[term] = min(self.term_min_dl.get(term, dl), dl)
+        self.tail_postings += len(counts)
+
+        base_postings = int(self.base["offsets"][-1]) if self.base is not None else 0
+        if self.auto_merge and self.tail_postings > max(KEYWORD_TAIL_MIN_MERGE, KEYWORD_TAIL_MERGE_RATIO * base_postings):
+            self.merge_tail()
+
+    def merge_tail(self, compress: Optional[bool] = None):
+        """Fold the tail into a new CSR base (vectorized; the old base is never modified)."""
+        compress = KEYWORD_POSTINGS_COMPRESS if compress is None else compress
+        base = self.base
+        if not self.terms and base is not None and base["compressed"] == compress:
+            return
+
+        # Vocabulary: tail-only terms are spliced into the sorted base blob
+        if base is not None:
+            vocab, n_base = base["vocab"], len(base["vocab"])
+            base_ids, base_tfs = self._decode_all(base)
+            base_counts = np.diff(base["offsets"])
+        else:
+            vocab, n_base = _BlobStrings(np.zeros(0, dtype="uint8"), np.zeros(1, dtype="int64")), 0
+            base_ids, base_tfs = np.zeros(0, dtype="uint32"), np.zeros(0, dtype="uint16")
+            base_counts = np.zeros(0, dtype="int64")
+        tail_slots = {t: vocab.find(t) for t in self.terms}
+        new_terms = sorted((t.encode("utf-8") for t, s in tail_slots.items() if s < 0))
+        insert_at = np.asarray([bisect.bisect_left(vocab, t) for t in new_terms], dtype="int64")
+        base_to_new = np.arange(n_base) + np.searchsorted(insert_at, np.arange(n_base), side="right")
+        new_slots = insert_at + np.arange(len(new_terms))
+        n_vocab = n_base + len(new_terms)
+
+        new_lengths = np.zeros(n_vocab, dtype="int64")
+        new_lengths[base_to_new] = np.diff(vocab.offsets)
+        new_lengths[new_slots] = [len(t) for t in new_terms]
+        blob = np.insert(np.asarray(vocab.blob), np.repeat(vocab.offsets[insert_at], [len(t) for t in new_terms]),
+                         np.frombuffer(b"".join(new_terms), dtype="uint8"))
+        new_vocab = _BlobStrings(blob, np.concatenate([[0], np.cumsum(new_lengths)]).astype("int64"))
+
+        # Postings: tag every posting with its new term slot, then stable-sort by slot
+        # (base doc ids are all smaller than tail doc ids, so each list stays sorted)
+        slot_of = {t: (int(base_to_new[s]) if s >= 0 else None) for t, s in tail_slots.items()}
+        for t, pos in zip(new_terms, new_slots):
+            slot_of[t.decode("utf-8")] = int(pos)
+        tail_items = sorted(self.terms.items(), key=lambda kv: slot_of[kv[0]])
+        term_keys = np.concatenate([np.repeat(base_to_new, base_counts)] +
+                                   [np.full(len(ids), slot_of[t], dtype="int64") for t, (ids, _) in tail_items])
+        ids = np.concatenate([base_ids.astype("uint32")] + [np.frombuffer(ids, dtype="uint32") for _, (ids, _) in tail_items])
+        tfs = np.concatenate([base_tfs.astype("uint16")] + [np.frombuffer(tfs, dtype="uint16") for _, (_, tfs) in tail_items])
+        order = np.argsort(term_keys, kind="stable")
+        ids, tfs = ids[order], tfs[order]
+        counts = np.bincount(term_keys, minlength=n_vocab)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype("int64")
+
+        max_tf = np.zeros(n_vocab, dtype="uint16")
+        min_dl = np.full(n_vocab, 0xFFFFFFFF, dtype="uint32")
+        if base is not None:
+            max_tf[base_to_new] = base["max_tf"]
+            min_dl[base_to_new] = base["min_dl"]
+        for t, slot in slot_of.items():
+            max_tf[slot] = max(int(max_tf[slot]), min(self.term_max_tf[t], 0xFFFF))
+            min_dl[slot] = min(int(min_dl[slot]), self.term_min_dl[t])
+
+        new_base = {"vocab": new_vocab, "offsets": offsets, "max_tf": max_tf, "min_dl": min_dl, "compressed": compress}
+        if compress:
+            starts = offsets[:-1][counts > 0]
+            deltas = ids.astype("int64")
+            deltas[1:] -= ids[:-1].astype("int64")
+            deltas[starts] = ids[starts]            # each list restarts from its first id
+            id_bytes, id_sizes = _varint_encode(deltas)
+            tf_bytes, tf_sizes = _varint_encode(tfs)
+            new_base["ids"], new_base["tfs"] = id_bytes, tf_bytes
+            new_base["id_offsets"] = np.concatenate([[0], np.cumsum(id_sizes)])[offsets].astype("int64")
+            new_base["tf_offsets"] = np.concatenate([[0], np.cumsum(tf_sizes)])[offsets].astype("int64")
+        else:
+            new_base["ids"], new_base["tfs"] = ids, tfs
+
+        self.base = new_base
+        self.base_doc_lens = np.concatenate([np.asarray(self.base_doc_lens, dtype="uint32"),
+                                             np.frombuffer(self.doc_lens, dtype="uint32")])
+        self.terms, self.term_max_tf, self.term_min_dl = {}, {}, {}
+        self.doc_lens = array("I")
+        self.tail_postings = 0
+
+    def copy(self) -> "KeywordIndex":
+        """Writable copy for the next index generation: shares the CSR base, copies the tail."""
+        new = KeywordIndex.__new__(KeywordIndex)
+        new.__dict__.update(self.__dict__)
+        new.terms = {t: (array("I", ids), array("H", tfs)) for t, (ids, tfs) in self.terms.items()}
+        new.term_max_tf, new.term_min_dl = dict(self.term_max_tf), dict(self.term_min_dl)
+        new.doc_lens = array("I", self.doc_lens)
+        new._idf = dict(self._idf)
+        return new
+
+    @staticmethod
+    def _decode_all(base) -> Tuple[np.ndarray, np.ndarray]:
+        if not base["compressed"]:
+            return np.asarray(base["ids"]), np.asarray(base["tfs"])
+        values = np.cumsum(_varint_decode(base["ids"]))
+        starts = base["offsets"][:-1]
+        counts = np.diff(base["offsets"])
+        before = np.concatenate([[0], values])[starts]    # running total at each list start
+        ids = values - np.repeat(before, counts)
+        return ids.astype("uint32"), _varint_decode(base["tfs"]).astype("uint16")
+
+    # ---------------------- lookups ----------------------
+    @property
+    def n_docs(self) -> int:
+        return len(self.base_doc_lens) + len(self.doc_lens)
+
+    def doc_len(self, doc_id: int) -> int:
+        n_base = len(self.base_doc_lens)
+        return int(self.base_doc_lens[doc_id]) if doc_id < n_base else self.doc_lens[doc_id - n_base]
+
+    def _base_slot(self, term: str) -> int:
+        return self.base["vocab"].find(term) if self.base is not None else -1
+
+    def postings(self, term: str):
+        """(doc ids, term frequencies) for a term, base postings first."""
+        slot = self._base_slot(term)
+        entry = self.terms.get(term)
+        if slot < 0:
+            return entry if entry is not None else ((), ())
+        base = self.base
+        if base["compressed"]:
+            id_buf = base["ids"][base["id_offsets"][slot]:base["id_offsets"][slot + 1]]
+            tf_buf = base["tfs"][base["tf_offsets"][slot]:base["tf_offsets"][slot + 1]]
+            ids = np.cumsum(_varint_decode(id_buf)).astype("uint32")
+            tfs = _varint_decode(tf_buf).astype("uint16")
+        else:
+            lo, hi = base["offsets"][slot], base["offsets"][slot + 1]
+            ids, tfs = base["ids"][lo:hi], base["tfs"][lo:hi]
+        if entry is not None:
+            ids = np.concatenate([ids, np.frombuffer(entry[0], dtype="uint32")])
+            tfs = np.concatenate([tfs, np.frombuffer(entry[1], dtype="uint16")])
+        return ids, tfs
+
+    def df(self, term: str) -> int:
+        slot = self._base_slot(term)
+        n = int(self.base["offsets"][slot + 1] - self.base["offsets"][slot]) if slot >= 0 else 0
+        entry = self.terms.get(term)
+        return n + (len(entry[0]) if entry is not None else 0)
+
+    def idf(self, term: str) -> float:
+        """BM25 idf, cached per term until the corpus size changes."""
+        n = self.n_docs
+        cached = self._idf.get(term)
+        if cached is None or cached[0] != n:
+            df = self.df(term)
+            cached = self._idf[term] = (n, math.log(1.0 + (n - df + 0.5) / (df + 0.5)))
+        return cached[1]
+
+    def _term_bounds(self, term: str) -> Tuple[int, int]:
+        """Largest tf and shortest doc length over a term's postings."""
+        max_tf, min_dl = self.term_max_tf.get(term, 0), self.term_min_dl.get(term, 1 << 31)
+        slot = self._base_slot(term)
+        if slot >= 0:
+            max_tf = max(max_tf, int(self.base["max_tf"][slot]))
+            min_dl = min(min_dl, int(self.base["min_dl"][slot]))
+        return max_tf, min_dl
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.terms or self._base_slot(term) >= 0
+
+    def __len__(self) -> int:
+        n = len(self.base["vocab"]) if self.base is not None else 0
+        return n + sum(1 for t in self.terms if self._base_slot(t) < 0)
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """Approximate footprint: CSR base arrays vs the Python-object tail."""
+        base_bytes = 0
+        if self.base is not None:
+            base = self.base
+            arrays = [base["vocab"].blob, base["vocab"].offsets, base["offsets"], base["ids"], base["tfs"],
+                      base["max_tf"], base["min_dl"]] + [base[k] for k in ("id_offsets", "tf_offsets") if k in base]
+            base_bytes = sum(a.nbytes for a in arrays) + self.base_doc_lens.nbytes
+        tail_bytes = sys.getsizeof(self.terms) + sys.getsizeof(self.term_max_tf) + sys.getsizeof(self.term_min_dl)
+        tail_bytes += sum(sys.getsizeof(t) + sys.getsizeof(ids) + sys.getsizeof(tfs) for t, (ids, tfs) in self.terms.items())
+        tail_bytes += sys.getsizeof(self.doc_lens)
+        return {
+            "terms": len(self),
+            "base_postings": int(self.base["offsets"][-1]) if self.base is not None else 0,
+            "tail_postings": self.tail_postings,
+            "base_bytes": int(base_bytes),
+            "tail_bytes": int(tail_bytes),
+            "compressed": bool(self.base["compressed"]) if self.base is not None else KEYWORD_POSTINGS_COMPRESS,
+            "memory_mapped": isinstance(self.base_doc_lens, np.memmap),
+        }
+
+    # ---------------------- ranking ----------------------
+    def _doc_lens_of(self, ids: np.ndarray) -> np.ndarray:
+        """Document lengths for an array of doc ids (base and tail)."""
+        n_base = len(self.base_doc_lens)
+        if not len(self.doc_lens):
+            return np.asarray(self.base_doc_lens[ids], dtype="float64")
+        tail = np.frombuffer(self.doc_lens, dtype="uint32")
+        out = np.empty(len(ids), dtype="float64")
+        in_base = ids < n_base
+        out[in_base] = self.base_doc_lens[ids[in_base]]
+        out[~in_base] = tail[ids[~in_base] - n_base]
+        return out
+
+    def search(self, query_terms: List[str], k: int = KEYWORD_TOP_K) -> List[Tuple[float, int, int]]:
+        """
+        Top-k docs by BM25 as (score, doc id, number of query terms matched), best first.
+        Each posting list is scored as one numpy slice, strongest term (highest score upper
+        bound) first. MaxScore: once the k-th best candidate score reaches the summed bounds of
+        the remaining terms, those lists can no longer add new docs to the top k, so they are
+        only probed (searchsorted) for the surviving candidates instead of being merged in.
+        """
+        n = self.n_docs
+        if n == 0:
+            return []
+        avgdl = max(self.total_len, 1) / n
+        k1, b = BM25_K1, BM25_B
+
+        lists = []
+        for term in set(query_terms):
+            ids, tfs = self.postings(term)
+            if len(ids) == 0:
+                continue
+            idf = self.idf(term)
+            max_tf, min_dl = self._term_bounds(term)
+            bound = idf * max_tf * (k1 + 1) / (max_tf + k1 * (1 - b + b * min_dl / avgdl))
+            lists.append((bound, idf, ids, tfs))
+        if not lists:
+            return []
+        lists.sort(key=lambda l: l[0], reverse=True)
+        rest_bounds = list(itertools.accumulate(l[0] for l in reversed(lists)))[::-1]
+
+        def term_scores(idf, ids, tfs):
+            tf = np.asarray(tfs, dtype="float64")
+            return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * self._doc_lens_of(ids) / avgdl))
+
+        cand_ids = np.zeros(0, dtype="int64")
+        cand_scores = np.zeros(0, dtype="float64")
+        cand_matched = np.zeros(0, dtype="int64")
+        for j, (_, idf, ids, tfs) in enumerate(lists):
+            ids = np.asarray(ids, dtype="int64")
+            threshold = np.partition(cand_scores, -k)[-k] if len(cand_ids) >= k else None
+            if threshold is None or rest_bounds[j] > threshold:
+                # Essential: docs first seen in this list may still reach the top k
+                merged = np.concatenate([cand_ids, ids])
+                cand_ids, inverse = np.unique(merged, return_inverse=True)
+                cand_scores = np.bincount(inverse, np.concatenate([cand_scores, term_scores(idf, ids, tfs)]),
+                                          minlength=len(cand_ids))
+                cand_matched = np.bincount(inverse, np.concatenate([cand_matched, np.ones(len(ids), dtype="int64")]),
+                                           minlength=len(cand_ids)).astype("int64")
+                continue
+            # Non-essential: drop candidates that cannot catch up, probe this list for the rest
+            keep = cand_scores + rest_bounds[j] >= threshold
+            cand_ids, cand_scores, cand_matched = cand_ids[keep], cand_scores[keep], cand_matched[keep]
+            pos = np.searchsorted(ids, cand_ids)
+            hit = pos < len(ids)
+            hit[hit] = ids[pos[hit]] == cand_ids[hit]
+            if hit.any():
+                tfs_hit = np.asarray(tfs)[pos[hit]]
+                cand_scores[hit] += term_scores(idf, cand_ids[hit], tfs_hit)
+                cand_matched[hit] += 1
+
+        if len(cand_ids) > k:
+            top = np.argpartition(-cand_scores, k - 1)[:k]
+            # keep every doc tied with the k-th score so the doc-id tie-break below stays exact
+            top = np.flatnonzero(cand_scores >= cand_scores[top].min())
+            cand_ids, cand_scores, cand_matched = cand_ids[top], cand_scores[top], cand_matched[top]
+        order = np.lexsort((cand_ids, -cand_scores))[:k]
+        return [(float(cand_scores[i]), int(cand_ids[i]), int(cand_matched[i])) for i in order]
+
+    # ---------------------- bundle (de)serialization ----------------------
+    def save(self, bundle_dir: str) -> int:
+        """Merge the tail and write the CSR base; returns the vocabulary size."""
+        self.merge_tail()
+        base = self.base
+        np.save(os.path.join(bundle_dir, "keyword_vocab_blob.npy"), np.asarray(base["vocab"].blob))
+        np.save(os.path.join(bundle_dir, "keyword_vocab_offsets.npy"), np.asarray(base["vocab"].offsets))
+        for name in ("offsets", "ids", "tfs", "max_tf", "min_dl", "id_offsets", "tf_offsets"):
+            if name in base:
+                np.save(os.path.join(bundle_dir, f"keyword_{name}.npy"), np.asarray(base[name]))
+        np.save(os.path.join(bundle_dir, "keyword_doc_lens.npy"), np.asarray(self.base_doc_lens))
+        with open(os.path.join(bundle_dir, "keyword_meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"compressed": base["compressed"], "total_len": self.total_len}, f)
+        return len(base["vocab"])
+
+    @classmethod
+    def load(cls, bundle_dir: str) -> "KeywordIndex":
+        load = lambda name: np.load(os.path.join(bundle_dir, f"keyword_{name}.npy"), mmap_mode="r")
+        with open(os.path.join(bundle_dir, "keyword_meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls()
+        index.base = {
+            "vocab": _read_blob_strings(bundle_dir, "keyword_vocab"),
+            "offsets": load("offsets"),
+            "ids": load("ids"),
+            "tfs": load("tfs"),
+            "max_tf": load("max_tf"),
+            "min_dl": load("min_dl"),
+            "compressed": meta["compressed"],
+        }
+        if meta["compressed"]:
+            index.base["id_offsets"], index.base["tf_offsets"] = load("id_offsets"), load("tf_offsets")
+        index.base_doc_lens = load("doc_lens")
+        index.total_len = int(meta["total_len"])
+        return index
+
+def benchmark_keyword_search(sizes=(10_000, 100_000, 200_000), repeats: int = 20) -> List[Dict[str, Any]]:
+    """
+    Time KeywordIndex.search on synthetic Zipf-distributed corpora of growing size
+    (`python main.py bench-keyword [size ...]`). Query latency should grow with the length
+    of the posting lists, at numpy speed, not with a Python loop per posting.
+    """
+    rng = np.random.default_rng(0)
+    vocab = [f"term{i:05d}" for i in range(20_000)]
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+    queries = {
+        "one common term": [vocab[0]],
+        "two common terms": [vocab[0], vocab[1]],
+        "common + rare": [vocab[2], vocab[5000]],
+        "five mixed terms": [vocab[0], vocab[3], vocab[50], vocab[800], vocab[9000]],
+    }
+    results = []
+    for size in sizes:
+        index = KeywordIndex()
+        words = rng.choice(len(vocab), size=(size, 60), p=weights)
+        for doc_id, row in enumerate(words):
+            index.add_document(doc_id, " ".join(vocab[w] for w in row))
+        index.merge_tail()
+        for name, terms in queries.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                index.search(terms)
+            ms = (time.perf_counter() - start) * 1000 / repeats
+            results.append({"docs": size, "query": name, "postings": sum(index.df(t) for t in terms), "ms": round(ms, 2)})
+            print(f"{size:>9} docs  {name:<18} {results[-1]['postings']:>9} postings  {ms:8.2f} ms")
+    return results
+
+# ====================== PREBUILT INDEX BUNDLE ======================
+# `python main.py build-index` writes every in-memory index into one versioned directory:
+#   manifest.json          version, model, doc count, document store fingerprint, file list
+#   semantic.faiss         FAISS index, flat/HNSW/IVF (opened with IO_FLAG_MMAP unless IVF)
+#   passage_offsets.npy    first passage row of every embedded doc (n+1)
+#   docs.jsonl             one JSON doc per line + doc_offsets.npy (byte offsets, n+1)
+#   keyword_*.npy          CSR postings (sorted vocabulary, offsets, doc ids, tfs) + BM25 stats
+#   keyword_meta.json      postings encoding (raw uint32/uint16 or delta+varint) + total length
+#   source_* / topic_*     sorted key blobs -> doc index
+#   text_hashes.npy        sorted sha256 hex digests (dedup table)
+# All arrays are opened as numpy memmaps, so startup cost no longer depends on corpus size
+# and several workers on one host share the same page cache instead of private copies.
+INDEX_BUNDLE_VERSION = 5
+
+class _BlobStrings:
+    """Sorted byte strings stored as one blob + offsets; indexable, so `bisect` works on it."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def find(self, key: str) -> int:
+        k = key.encode("utf-8")
+        i = bisect.bisect_left(self, k)
+        return i if i < len(self) and self[i] == k else -1
+
+def _write_blob_strings(bundle_dir: str, name: str, keys: List[str]):
+    encoded = [k.encode("utf-8") for k in keys]
+    offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    np.cumsum([len(k) for k in encoded], out=offsets[1:])
+    np.save(os.path.join(bundle_dir, f"{name}_blob.npy"), np.frombuffer(b"".join(encoded), dtype="uint8"))
+    np.save(os.path.join(bundle_dir, f"{name}_offsets.npy"), offsets)
+
+def _read_blob_strings(bundle_dir: str, name: str) -> _BlobStrings:
+    return _BlobStrings(
+        np.load(os.path.join(bundle_dir, f"{name}_blob.npy"), mmap_mode="r"),
+        np.load(os.path.join(bundle_dir, f"{name}_offsets.npy"), mmap_mode="r"),
+    )
+
+class MappedStringMap:
+    """Read-only str -> doc index map backed by memmaps (used as the base of a LayeredMap)."""
+
+    def __init__(self, keys: _BlobStrings, values: np.ndarray):
+        self.keys = keys
+        self.values = values
+
+    def __contains__(self, key: str) -> bool:
+        return self.keys.find(key) >= 0
+
+    def __getitem__(self, key: str) -> int:
+        i = self.keys.find(key)
+        if i < 0:
+            raise KeyError(key)
+        return int(self.values[i])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def items(self):
+        for i in range(len(self.keys)):
+            yield self.keys[i].decode("utf-8"), int(self.values[i])
+
+LAYERED_MAP_MIN_FOLD = 50_000
+
+class LayeredMap:
+    """
+    Immutable str -> doc index map: a shared base (dict or MappedStringMap) plus a small overlay.
+    updated() returns a new map, so a published index generation never changes under readers.
+    The overlay is folded into a fresh dict base once it outgrows max(LAYERED_MAP_MIN_FOLD, 10% of
+    the base); memmapped bases keep their overlay until the next bundle build.
+    """
+
+    def __init__(self, base=None, overlay: Optional[Dict[str, int]] = None):
+        self.base = base if base is not None else {}
+        self.overlay = overlay or {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.overlay or key in self.base
+
+    def __getitem__(self, key: str) -> int:
+        if key in self.overlay:
+            return self.overlay[key]
+        return self.base[key]
+
+    def __len__(self) -> int:
+        return len(self.base) + sum(1 for k in self.overlay if k not in self.base)
+
+    def items(self):
+        for key, value in self.base.items():
+            if key not in self.overlay:
+                yield key, value
+        yield from self.overlay.items()
+
+    def updated(self, updates: Dict[str, int]) -> "LayeredMap":
+        if not updates:
+            return self
+        overlay = {**self.overlay, **updates}
+        if isinstance(self.base, dict) and len(overlay) > max(LAYERED_MAP_MIN_FOLD, len(self.base) // 10):
+            return LayeredMap({**self.base, **overlay})
+        return LayeredMap(self.base, overlay)
+
+class MappedHashSet:
+    """Sorted memmapped sha256 hex digests with an in-memory set for hashes added since."""
+
+    def __init__(self, hashes: np.ndarray):
+        self.hashes = hashes
+        self.extra = set()
+
+    def __contains__(self, h: str) -> bool:
+        if h in self.extra:
+            return True
+        key = h.encode("ascii")
+        i = int(np.searchsorted(self.hashes, key))
+        return i < len(self.hashes) and self.hashes[i] == key
+
+    def add(self, h: str):
+        if h not in self:
+            self.extra.add(h)
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.extra)
+
+class MappedDocs:
+    """List-like view over docs.jsonl; documents are parsed on access, appends stay in memory."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+        self.base_len = len(offsets) - 1
+        self.tail: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return self.base_len + len(self.tail)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if i >= self.base_len:
+            return self.tail[i - self.base_len]
+        return json.loads(self.data[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, doc: Dict[str, Any]):
+        self.tail.append(doc)
+
+    def extend(self, new_docs: List[Dict[str, Any]]):
+        self.tail.extend(new_docs)
+
+    def __delitem__(self, s: slice):
+        """Only `del docs[n:]` with n >= base_len (drop appends that were never published)."""
+        if s.start is None or s.start < self.base_len or s.stop is not None:
+            raise ValueError("only trailing appended docs can be removed")
+        del self.tail[s.start - self.base_len:]
+
+def build_index_bundle(bundle_dir: str = INDEX_BUNDLE_DIR) -> Dict[str, Any]:
+    """Write the current index generation as a versioned bundle (atomic directory swap)."""
+    gen = index_generation
+    docs = [gen.docs[i] for i in range(gen.n_docs)]
+    tmp_dir = f"{bundle_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # Doc table
+    offsets = [0]
+    with open(os.path.join(tmp_dir, "docs.jsonl"), "wb") as f:
+        for doc in docs:
+            line = json.dumps({"text": doc.get("text", ""), "source": doc.get("source", "")}, ensure_ascii=False)
+            f.write(line.encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+    np.save(os.path.join(tmp_dir, "doc_offsets.npy"), np.asarray(offsets, dtype="int64"))
+
+    # Keyword postings in CSR form (save() merges the tail, so it works on a copy)
+    keyword_terms = gen.keyword_index.copy().save(tmp_dir)
+
+    # Source / topic lookups (last writer wins, like the in-memory dicts)
+    for name, mapping in (("source", gen.source_index), ("topic", gen.topic_index)):
+        mapping = dict(mapping.items())
+        keys = sorted(mapping, key=lambda k: k.encode("utf-8"))
+        _write_blob_strings(tmp_dir, f"{name}_keys", keys)
+        np.save(os.path.join(tmp_dir, f"{name}_values.npy"), np.asarray([mapping[k] for k in keys], dtype="int64"))
+
+    # Dedup hash table
+    np.save(os.path.join(tmp_dir, "text_hashes.npy"),
+            np.sort(np.asarray([_text_hash(d.get("text", "")) for d in docs], dtype="S64")))
+
+    # Semantic index (vectors added since the last merge are folded into a copy of the base)
+    semantic_index = gen.semantic_base
+    if gen.semantic_chunks:
+        semantic_index = faiss.clone_index(semantic_index)
+        semantic_index.add(_semantic_vectors(gen, semantic_index.ntotal, gen.semantic_ntotal))
+    faiss.write_index(semantic_index, os.path.join(tmp_dir, "semantic.faiss"))
+    np.save(os.path.join(tmp_dir, "passage_offsets.npy"),
+            np.asarray(gen.passage_offsets[:gen.semantic_docs + 1], dtype="int64"))
+
+    manifest = {
+        "version": INDEX_BUNDLE_VERSION,
+        "model": EMBED_MODEL_NAME,
+        "dim": int(semantic_index.d),
+        "doc_count": len(docs),
+        "vector_count": int(semantic_index.ntotal),
+        "passages": {"chars": PASSAGE_CHARS, "overlap": PASSAGE_OVERLAP},
+        "semantic_index": _semantic_index_kind(semantic_index),
+        "semantic_recall": SEMANTIC_RECALL,
+        "keyword_terms": keyword_terms,
+        "store": doc_store.fingerprint(),
+        "built_at": time.time(),
+        "files": sorted(os.listdir(tmp_dir)),
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Swap directories so readers never see a half-written bundle
+    old_dir = f"{bundle_dir}.old-{os.getpid()}"
+    if os.path.exists(bundle_dir):
+        os.replace(bundle_dir, old_dir)
+    os.replace(tmp_dir, bundle_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    print(f"📦 Index bundle written to {bundle_dir}: {manifest['doc_count']} docs, {manifest['keyword_terms']} terms")
+    return manifest
+
+def _load_index_bundle(bundle_dir: str):
+    """
+    Memory-map a prebuilt bundle and publish it as the next index generation. Returns the bundled
+    FAISS index (kept aside until the embedder is loaded), or None if absent or stale.
+    """
+    global text_hashes
+
+    manifest_path = os.path.join(bundle_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if (manifest.get("version") != INDEX_BUNDLE_VERSION or manifest.get("model") != EMBED_MODEL_NAME
+                or manifest.get("passages") != {"chars": PASSAGE_CHARS, "overlap": PASSAGE_OVERLAP}):
+            print("⚠️ Index bundle was built for another version/model/passage size — rebuilding in memory")
+            return None
+        # The store is append-only, so a bundle of the same store is a valid prefix of it
+        store = manifest.get("store", {})
+        if store.get("store_id") != doc_store.fingerprint()["store_id"] or store.get("docs", 0) > len(doc_store):
+            print("⚠️ Index bundle does not match the document store — rebuilding in memory "
+                  "(run `python main.py build-index` to refresh it)")
+            return None
+
+        path = lambda name: os.path.join(bundle_dir, name)
+        docs = MappedDocs(np.memmap(path("docs.jsonl"), dtype="uint8", mode="r"),
+                          np.load(path("doc_offsets.npy"), mmap_mode="r"))
+        passage_offsets = array("q", np.load(path("passage_offsets.npy")).tolist())
+        gen = index_generation.next(
+            docs=docs,
+            n_docs=len(docs),
+            keyword_index=KeywordIndex.load(bundle_dir),
+            source_index=LayeredMap(MappedStringMap(_read_blob_strings(bundle_dir, "source_keys"),
+                                                    np.load(path("source_values.npy"), mmap_mode="r"))),
+            topic_index=LayeredMap(MappedStringMap(_read_blob_strings(bundle_dir, "topic_keys"),
+                                                   np.load(path("topic_values.npy"), mmap_mode="r"))),
+            semantic_base=None,
+            semantic_chunks=(),
+            passage_offsets=passage_offsets,
+            semantic_docs=len(passage_offsets) - 1,
+        )
+        hashes = MappedHashSet(np.load(path("text_hashes.npy"), mmap_mode="r"))
+        # IVF inverted lists opened with IO_FLAG_MMAP are read-only, so those are loaded into RAM
+        flags = 0 if manifest.get("semantic_index") == "ivf" else faiss.IO_FLAG_MMAP
+        semantic_index = _tune_semantic_index(faiss.read_index(path("semantic.faiss"), flags))
+        SEMANTIC_RECALL.update(manifest.get("semantic_recall") or {})
+    except Exception as e:
+        print(f"⚠️ Index bundle unreadable, rebuilding in memory: {e}")
+        return None
+
+    text_hashes = hashes
+    _publish_generation(gen)
+    print(f"📦 Index bundle mapped from {bundle_dir} ({manifest['doc_count']} docs)")
+    return semantic_index
+
+# ====================== INDEX GENERATIONS ======================
+class IndexGeneration:
+    """
+    One consistent, immutable snapshot of every query-side index. Readers take `index_generation`
+    once per query and use only that object, so they never see half-applied updates; writers
+    (under _index_lock) derive the next generation from the current one and publish it with a
+    single reference assignment.
+    - docs: append-only container shared between generations; this one covers docs[:n_docs]
+    - keyword_index / source_index / topic_index: never mutated once published (the keyword tail
+      and the map overlays are copied by the writer)
+    - semantic_base: FAISS index for passage rows [0, ntotal), never added to once published
+    - semantic_chunks: small flat indexes, one per update, for the rows after the base
+    - passage_offsets / semantic_docs: docs[:semantic_docs] are embedded, doc i as the passage
+      rows [passage_offsets[i], passage_offsets[i + 1]) (append-only array shared like docs)
+    `number` keys the answer cache, so answers computed on an older generation are not reused.
+    """
+    __slots__ = ("number", "docs", "n_docs", "keyword_index", "source_index", "topic_index",
+                 "semantic_base", "semantic_chunks", "passage_offsets", "semantic_docs")
+
+    def __init__(self, number: int, docs, n_docs: int, keyword_index: KeywordIndex, source_index: LayeredMap,
+                 topic_index: LayeredMap, semantic_base=None, semantic_chunks: Tuple = (),
+                 passage_offsets: Optional[array] = None, semantic_docs: int = 0):
+        self.number = number
+        self.docs = docs
+        self.n_docs = n_docs
+        self.keyword_index = keyword_index
+        self.source_index = source_index
+        self.topic_index = topic_index
+        self.semantic_base = semantic_base
+        self.semantic_chunks = semantic_chunks
+        self.passage_offsets = passage_offsets if passage_offsets is not None else array("q", [0])
+        self.semantic_docs = semantic_docs
+
+    def next(self, **changes) -> "IndexGeneration":
+        fields = {name: getattr(self, name) for name in self.__slots__ if name != "number"}
+        fields.update(changes)
+        return IndexGeneration(self.number + 1, **fields)
+
+    @property
+    def semantic_ready(self) -> bool:
+        return self.semantic_base is not None
+
+    @property
+    def semantic_ntotal(self) -> int:
+        if self.semantic_base is None:
+            return 0
+        return int(self.semantic_base.ntotal) + sum(int(c.ntotal) for c in self.semantic_chunks)
+
+    def passage_parent(self, row: int) -> int:
+        return bisect.bisect_right(self.passage_offsets, row, 0, self.semantic_docs + 1) - 1
+
+    def passage_text(self, row: int) -> str:
+        doc = self.passage_parent(row)
+        return _split_passages(self.docs[doc].get("text", ""))[row - self.passage_offsets[doc]]
+
+    def search_semantic(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k docs, ranked by their best passages (see _aggregate_passages)."""
+        if self.semantic_ntotal == self.semantic_docs:
+            return self.search_passages(queries, k)   # one passage per doc: rows are doc ids
+        scores, rows = self.search_passages(queries, k * PASSAGE_SEARCH_FACTOR)
+        return _aggregate_passages(self, scores, rows, k)
+
+    def search_passages(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k passage rows over the base index and every chunk, merged by score."""
+        scores, ids = _semantic_search(self.semantic_base, queries, k, self)
+        offset = int(self.semantic_base.ntotal)
+        for chunk in self.semantic_chunks:
+            chunk_scores, chunk_ids = chunk.search(queries, min(k, chunk.ntotal))
+            scores = np.hstack([scores, chunk_scores])
+            ids = np.hstack([ids, np.where(chunk_ids >= 0, chunk_ids + offset, -1)])
+            offset += int(chunk.ntotal)
+        if self.semantic_chunks:
+            order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+            scores, ids = np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+        return scores, ids
+
+index_generation = IndexGeneration(0, [], 0, KeywordIndex(), LayeredMap(), LayeredMap())
+# Starts empty and is replaced by _load_knowledge_base() in the background (see STARTUP)
+
+text_hashes = set()                # sha256 of every doc text, for dedup (writer-side only)
+doc_store: Optional[DocumentStore] = None
+
+_index_lock = threading.RLock()
+# Serializes writers (startup loader, live-fallback appends); readers stay lock-free
+
+def _publish_generation(gen: IndexGeneration):
+    """Make `gen` the generation new queries see (caller holds _index_lock)."""
+    global index_generation
+    index_generation = gen
+
+def _index_documents(doc_iter) -> Tuple[Dict[str, Any], set]:
+    """Build docs + exact/keyword indexes from scratch: (generation fields, text hashes)."""
+    new_docs = []
+    new_keyword_index = KeywordIndex()
+    new_source_index = {}
+    new_topic_index = {}
+    new_text_hashes = set()
+
+    for idx, doc in enumerate(doc_iter):
+        new_docs.append(doc)
+        # Each entry: {"text": "...", "source": "..."}
+
+        # Index by source
+        source = doc.get("source", "").lower()
+        new_source_index[source] = idx
+
+        # PATCH: Use improved topic extraction for all sources
+        clean_topic = _extract_topic_from_source(source)
+        if clean_topic:
+            new_topic_index[clean_topic] = idx
+
+        # Index by keywords in text (only words > 3 chars are meaningful)
+        text = doc.get("text", "")
+        new_keyword_index.add_document(idx, text)
+
+        # Dedup index
+        new_text_hashes.add(_text_hash(text))
+
+    new_keyword_index.merge_tail()
+    fields = dict(docs=new_docs, n_docs=len(new_docs), keyword_index=new_keyword_index,
+                  source_index=LayeredMap(new_source_index), topic_index=LayeredMap(new_topic_index),
+                  passage_offsets=array("q", [0]), semantic_docs=0)
+    return fields, new_text_hashes
+
+def _load_documents():
+    """
+    Load docs and build exact/keyword indexes as a new generation. Returns the bundled FAISS index
+    when the indexes came from the index bundle, else None.
+    """
+    global doc_store, text_hashes
+
+    print("🚀 Loading knowledge base...")
+    doc_store = DocumentStore(KNOWLEDGE_STORE_DIR, compress=KNOWLEDGE_STORE_COMPRESS)
+    if len(doc_store) == 0 and not os.path.exists(KNOWLEDGE_PATH):
+        raise FileNotFoundError(f"Knowledge file not found: {KNOWLEDGE_PATH}")
+
+    bundled_semantic = _load_index_bundle(INDEX_BUNDLE_DIR)
+    if bundled_semantic is not None:
+        # Index whatever was appended to the store after the bundle was built
+        _index_loaded_docs(list(doc_store.iter_docs(start=index_generation.n_docs)))
+    else:
+        # Create multiple indexes for better matching
+        gen_fields, new_text_hashes = _index_documents(doc_store.iter_docs())
+        text_hashes = new_text_hashes
+        _publish_generation(index_generation.next(**gen_fields, semantic_base=None, semantic_chunks=()))
+
+    # First run imports knowledge.json; later runs pick up docs the enricher scripts added to it
+    _index_loaded_docs(doc_store.import_json(KNOWLEDGE_PATH, text_hashes, _text_hash))
+
+    print(f"✅ Loaded {index_generation.n_docs} knowledge entries ({doc_store.stats()['segments']} store segments)")
+    return bundled_semantic
+
+def _index_loaded_docs(items: List[Dict[str, str]]):
+    """Index docs that are already persisted in the store (startup catch-up)."""
+    if not items:
+        return
+    for it in items:
+        text_hashes.add(_text_hash(it.get("text", "")))
+    _update_in_memory_indexes_locked(items)
+
+
+# ====================== PERSISTENT EMBEDDING CACHE ======================
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR", "embedding_cache")
+# Vectors are cached per model under EMBED_CACHE_DIR/<model>/ and keyed by _text_hash(text)
+
+def _text_hash(t: str) -> str:
+    return hashlib.sha256((t or "").strip().encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Append-only on-disk store of normalized embeddings, content-addressed by text hash.
+    Layout (one directory per model):
+      - meta.json    : {"model": ..., "dim": ...}
+      - vectors.f32  : raw float32 rows, appended in order
+      - keys.txt     : one sha256 hex digest per line, row i <-> line i
+      - LOCK         : flock()ed around opening and appending, so several processes can share it
+    Vectors are written before keys, so a crash can only leave orphan rows (or a torn key line);
+    whoever takes the lock next cuts them off. Under the lock every process first reads the keys
+    the others appended since, so a new row's number is always its line number in keys.txt.
+    """
+
+    def __init__(self, root: str, model_name: str):
+        self.dir = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.model_name = model_name
+        self.dim: Optional[int] = None
+        self.rows: Dict[str, int] = {}
+        self.n_rows = 0             # rows (= key lines) read so far
+        self._keys_bytes = 0        # bytes of keys.txt read so far
+        self._vectors = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.dir, exist_ok=True)
+        self._load()
+
+    @property
+    def _vec_path(self) -> str:
+        return os.path.join(self.dir, "vectors.f32")
+
+    @property
+    def _keys_path(self) -> str:
+        return os.path.join(self.dir, "keys.txt")
+
+    @contextmanager
+    def _file_locked(self):
+        """Hold LOCK (other processes); callers already hold self._lock (other threads)."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.dir, "LOCK"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
 
-    # Index by keywords in text
-    text = doc.get("text", "")
-    words = set(re.findall(r'\b\w+\b', text.lower()))
-    for word in words:
-        if len(word) > 3:  # Only index meaningful words
-            keyword_index[word].append(idx)
+    def _load(self):
+        with self._lock, self._file_locked():
+            try:
+                self._sync()
+            except Exception as e:
+                print(f"⚠️ Embedding cache unreadable, starting empty: {e}")
+                self.dim, self.rows, self.n_rows, self._keys_bytes, self._vectors = None, {}, 0, 0, None
+                for path in (self._vec_path, self._keys_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return
+        if self.n_rows:
+            print(f"💾 Embedding cache: {self.n_rows} vectors for {self.model_name}")
+
+    def _sync(self):
+        """
+        Read the keys appended (by any process) since the last call and drop what an interrupted
+        append left behind. Caller holds both locks, so no append is in flight.
+        """
+        if self.dim is None:
+            meta_path = os.path.join(self.dir, "meta.json")
+            if not os.path.exists(meta_path):
+                return
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model") != self.model_name:
+                return
+            self.dim = int(meta["dim"])
+        row_bytes = 4 * self.dim
+        n_vectors = os.path.getsize(self._vec_path) // row_bytes if os.path.exists(self._vec_path) else 0
+        n_before = self.n_rows
+        with open(self._keys_path, "a+b") as f:
+            f.seek(self._keys_bytes)
+            for line in f:
+                if not line.endswith(b"\n") or self.n_rows >= n_vectors:
+                    break   # torn line, or a key whose vector never made it
+                self.rows.setdefault(line.strip().decode("ascii"), self.n_rows)
+                self.n_rows += 1
+                self._keys_bytes += len(line)
+            if os.path.getsize(self._keys_path) > self._keys_bytes:
+                f.truncate(self._keys_bytes)
+        if n_vectors > self.n_rows:
+            with open(self._vec_path, "r+b") as f:
+                f.truncate(self.n_rows * row_bytes)
+        if self.n_rows != n_before:
+            self._remap()
+
+    def _remap(self):
+        n = self.n_rows
+        self._vectors = np.memmap(self._vec_path, dtype="float32", mode="r", shape=(n, self.dim)) if n else None
+
+    def lookup(self, hashes: List[str]) -> List[int]:
+        """Row number for each hash, -1 when not cached (by this or any other process, as of its last write)."""
+        with self._lock:
+            return [self.rows.get(h, -1) for h in hashes]
+
+    def take(self, rows: List[int]) -> np.ndarray:
+        with self._lock:
+            vectors = self._vectors
+        return np.asarray(vectors[np.asarray(rows, dtype="int64")], dtype="float32")
+
+    def put_many(self, hashes: List[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock, self._file_locked():
+            self._sync()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(os.path.join(self.dir, "meta.json"), "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            fresh, seen = [], set()
+            for i, h in enumerate(hashes):
+                if h not in self.rows and h not in seen:
+                    seen.add(h)
+                    fresh.append(i)
+            if not fresh:
+                return
+            with open(self._vec_path, "ab") as f:
+                f.write(vectors[fresh].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            keys = "".join(hashes[i] + "\n" for i in fresh).encode("ascii")
+            with open(self._keys_path, "ab") as f:
+                f.write(keys)
+            for i in fresh:
+                self.rows[hashes[i]] = self.n_rows
+                self.n_rows += 1
+            self._keys_bytes += len(keys)
+            self._remap()
+
+embedding_cache: Optional[EmbeddingCache] = None
+# Opened by the startup loader (reading keys.txt is O(cache size))
+
+def _encode_texts(texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Embed texts (normalized, float32), only running the model on texts not in the cache."""
+    if not texts:
+        return np.zeros((0, embedding_cache.dim or 0), dtype="float32")
+
+    hashes = [_text_hash(t) for t in texts]
+    rows = embedding_cache.lookup(hashes)
+
+    missing = {}
+    for h, t, row in zip(hashes, texts, rows):
+        if row < 0 and h not in missing:
+            missing[h] = t
+    embedding_cache.hits += len(texts) - len(missing)
+    embedding_cache.misses += len(missing)
+
+    if missing:
+        fresh = embedder.encode(list(missing.values()), normalize_embeddings=True, batch_size=batch_size)
+        embedding_cache.put_many(list(missing.keys()), np.asarray(fresh, dtype="float32"))
+        rows = embedding_cache.lookup(hashes)
+
+    return embedding_cache.take(rows)
 
 
 # ====================== SETUP EMBEDDER AND FAISS ======================
-print("🤖 Initializing RAG system...")
-# embedder = SentenceTransformer("all-MiniLM-L6-v2")
-embedder = SentenceTransformer("multi-qa-mpnet-base-dot-v1")
-# This converts text to numerical vectors
-
-# Prepare embeddings for semantic search
-doc_texts = [doc["text"] for doc in docs]
-embeddings = embedder.encode(doc_texts, normalize_embeddings=True)
-dim = embeddings.shape[1]
-semantic_index = faiss.IndexFlatIP(dim)
-semantic_index.add(embeddings.astype('float32'))
-# Creates FAISS index for fast similarity search
-# Uses: Cosine similarity (normalized dot product)
-
-print(f"✅ Semantic index ready with {len(doc_texts)} entries")
+embedder: Optional[SentenceTransformer] = None
+# This converts text to numerical vectors (loaded in the background, see STARTUP)
+
+EMBED_PROGRESS_CHUNK = 2048
+# Startup embeds in chunks of this many docs so /health can report progress
+
+SEMANTIC_INDEX_MODE = os.environ.get("SEMANTIC_INDEX_MODE", "flat").lower()
+# flat (exact scan) | hnsw | ivf_flat | ivf_pq. ANN modes (and quantized storage, see below) replace
+# the float32 flat index once the corpus reaches SEMANTIC_ANN_THRESHOLD vectors; below that an exact
+# scan is already fast and the memory is small.
+SEMANTIC_ANN_THRESHOLD = int(os.environ.get("SEMANTIC_ANN_THRESHOLD", "50000"))
+SEMANTIC_NLIST = int(os.environ.get("SEMANTIC_NLIST", "0"))             # IVF lists (0 = 4 * sqrt(n))
+SEMANTIC_NPROBE = int(os.environ.get("SEMANTIC_NPROBE", "16"))         # IVF lists scanned per query
+SEMANTIC_PQ_M = int(os.environ.get("SEMANTIC_PQ_M", "64"))             # IVF-PQ bytes per vector
+SEMANTIC_HNSW_M = int(os.environ.get("SEMANTIC_HNSW_M", "32"))         # HNSW graph degree
+SEMANTIC_EF_CONSTRUCTION = int(os.environ.get("SEMANTIC_EF_CONSTRUCTION", "80"))
+SEMANTIC_EF_SEARCH = int(os.environ.get("SEMANTIC_EF_SEARCH", "64"))   # HNSW candidates per query
+SEMANTIC_TRAIN_SAMPLE = 100_000
+# IVF/PQ/SQ8 training uses at most this many vectors (or 40 per list, whichever is larger)
+
+SEMANTIC_VECTOR_STORAGE = os.environ.get("SEMANTIC_VECTOR_STORAGE", "float32").lower()
+# How the index stores vectors: float32 (3 KB/doc) | fp16 (2x smaller) | sq8 (4x) | pq (768/SEMANTIC_PQ_M x)
+SEMANTIC_RESCORE_CANDIDATES = int(os.environ.get("SEMANTIC_RESCORE_CANDIDATES", "50"))
+# Quantized indexes return this many candidates, re-scored with the full-precision vectors of the
+# memory-mapped embedding cache (0 = trust the approximate scores)
+SEMANTIC_RECALL_QUERIES = 200
+# Sample size for the recall@10 measurement taken whenever a quantized/ANN index is built
+
+SEMANTIC_RECALL: Dict[str, Any] = {}
+# Last measured recall of the active index against exact float32 search (see _upgrade_semantic_index)
+
+SEMANTIC_MAX_CHUNKS = 8
+SEMANTIC_DELTA_MIN_MERGE = 20_000
+SEMANTIC_DELTA_MERGE_RATIO = 0.1
+# Incremental adds go into small immutable flat chunks (compacted into one past SEMANTIC_MAX_CHUNKS);
+# once they hold max(SEMANTIC_DELTA_MIN_MERGE, SEMANTIC_DELTA_MERGE_RATIO * base) vectors a background
+# job folds them into a copy of the base index (amortized O(1) copying per vector)
+
+PASSAGE_CHARS = int(os.environ.get("PASSAGE_CHARS", "1200"))
+PASSAGE_OVERLAP = int(os.environ.get("PASSAGE_OVERLAP", "200"))
+# Docs longer than PASSAGE_CHARS are embedded as overlapping passages (about 300 tokens each, within
+# what the embedder reads), so the whole text is searchable and not just its opening; 0 = whole docs.
+# Shorter docs stay one passage with the doc's own text, so their cached vectors remain valid.
+PASSAGE_SEARCH_FACTOR = 4
+# Passages retrieved per requested doc before aggregating them per parent
+PASSAGE_AGGREGATION = os.environ.get("PASSAGE_AGGREGATION", "max").lower()
+PASSAGE_SUM_WEIGHT = float(os.environ.get("PASSAGE_SUM_WEIGHT", "0.1"))
+# max: a doc scores as its best passage | sum: best passage + PASSAGE_SUM_WEIGHT * its other
+# retrieved passages, favouring docs that match throughout (scores can then exceed 1)
+
+def _split_passages(text: str) -> List[str]:
+    """Overlapping passages of PASSAGE_CHARS, cut at whitespace; deterministic, as rows are re-derived from it."""
+    text = (text or "").strip()
+    if PASSAGE_CHARS <= 0 or len(text) <= PASSAGE_CHARS:
+        return [text]
+    overlap = min(max(PASSAGE_OVERLAP, 0), PASSAGE_CHARS // 2)
+    passages, start = [], 0
+    while len(text) - start > PASSAGE_CHARS:
+        end = start + PASSAGE_CHARS
+        cut = text.rfind(" ", start + PASSAGE_CHARS // 2, end)
+        cut = cut if cut > 0 else end
+        passages.append(text[start:cut].strip())
+        nxt = max(cut - overlap, start + 1)
+        space = text.find(" ", nxt, cut)
+        start = space + 1 if space >= 0 else nxt
+    passages.append(text[start:].strip())
+    return passages
+
+def _doc_passages(docs, start: int, stop: int, offsets: array) -> List[str]:
+    """Passages of docs[start:stop], in row order; extends `offsets` to cover them."""
+    passages = []
+    for i in range(start, stop):
+        parts = _split_passages(docs[i].get("text", ""))
+        passages.extend(parts)
+        offsets.append(offsets[-1] + len(parts))
+    return passages
+
+def _aggregate_passages(gen: "IndexGeneration", scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Passage hits (sorted by score) -> top-k parent docs, scored per PASSAGE_AGGREGATION."""
+    weight = PASSAGE_SUM_WEIGHT if PASSAGE_AGGREGATION == "sum" else 0.0
+    out_scores = np.full((len(rows), k), -np.inf, dtype="float32")
+    out_ids = np.full((len(rows), k), -1, dtype="int64")
+    for r in range(len(rows)):
+        doc_scores: Dict[int, float] = {}
+        for score, row in zip(scores[r], rows[r]):
+            if row < 0:
+                continue
+            doc = gen.passage_parent(int(row))
+            if doc in doc_scores:
+                doc_scores[doc] += weight * float(score)
+            else:
+                doc_scores[doc] = float(score)   # the first hit of a doc is its best passage
+        top = heapq.nlargest(k, doc_scores.items(), key=lambda kv: kv[1])
+        for j, (doc, score) in enumerate(top):
+            out_scores[r, j], out_ids[r, j] = score, doc
+    return out_scores, out_ids
+
+def _semantic_factory_string(n: int) -> str:
+    """FAISS index_factory spec for SEMANTIC_INDEX_MODE + SEMANTIC_VECTOR_STORAGE at corpus size n."""
+    nlist = SEMANTIC_NLIST or max(16, int(4 * math.sqrt(n)))
+    codes = {"fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{SEMANTIC_PQ_M}"}.get(SEMANTIC_VECTOR_STORAGE, "Flat")
+    return {
+        "hnsw": f"HNSW{SEMANTIC_HNSW_M},{codes}",
+        "ivf_flat": f"IVF{nlist},{codes}",
+        "ivf_pq": f"IVF{nlist},PQ{SEMANTIC_PQ_M}",
+    }.get(SEMANTIC_INDEX_MODE, codes)
+
+def _semantic_code_size(index) -> int:
+    """Bytes stored per vector (codes only; HNSW links and IVF ids come on top)."""
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    ivf = faiss.try_extract_index_ivf(index)
+    return int(ivf.code_size if ivf is not None else index.code_size)
+
+def _semantic_search(index, queries: np.ndarray, k: int, gen: "IndexGeneration") -> Tuple[np.ndarray, np.ndarray]:
+    """index.search, plus exact re-scoring of the top candidates when the index is quantized."""
+    if SEMANTIC_RESCORE_CANDIDATES <= k or embedding_cache is None or _semantic_code_size(index) >= 4 * index.d:
+        return index.search(queries, k)
+    scores, ids = index.search(queries, SEMANTIC_RESCORE_CANDIDATES)
+    for r in range(len(queries)):
+        valid = np.flatnonzero((ids[r] >= 0) & (ids[r] < index.ntotal))
+        rows = np.asarray(embedding_cache.lookup([_text_hash(gen.passage_text(int(ids[r, j]))) for j in valid]), dtype="int64")
+        cached = rows >= 0
+        if cached.any():
+            scores[r, valid[cached]] = embedding_cache.take(rows[cached]) @ queries[r]
+        order = np.argsort(-scores[r], kind="stable")
+        scores[r], ids[r] = scores[r, order], ids[r, order]
+    return scores[:, :k], ids[:, :k]
+
+def _semantic_index_kind(index) -> str:
+    if index is None:
+        return "none"
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+def _tune_semantic_index(index):
+    """Apply the query-time knobs (nprobe / efSearch) to a freshly built or loaded index."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = SEMANTIC_NPROBE
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = SEMANTIC_EF_SEARCH
+    return index
+
+def _semantic_index_info() -> Dict[str, Any]:
+    gen = index_generation
+    index = gen.semantic_base
+    info = {"type": _semantic_index_kind(index), "mode": SEMANTIC_INDEX_MODE,
+            "vectors": gen.semantic_ntotal,
+            "delta_vectors": gen.semantic_ntotal - (int(index.ntotal) if index is not None else 0),
+            "delta_chunks": len(gen.semantic_chunks),
+            "docs": gen.semantic_docs, "passage_chars": PASSAGE_CHARS,
+            "ann_building": _semantic_upgrade_lock.locked()}
+    ivf = faiss.try_extract_index_ivf(index) if index is not None else None
+    if ivf is not None:
+        info.update(nlist=int(ivf.nlist), nprobe=int(ivf.nprobe))
+    if isinstance(index, faiss.IndexHNSW):
+        info["ef_search"] = int(index.hnsw.efSearch)
+    if index is not None:
+        code_size = _semantic_code_size(index)
+        info.update(bytes_per_vector=code_size, vector_bytes=code_size * int(index.ntotal),
+                    compression=round(4 * index.d / code_size, 1), recall=SEMANTIC_RECALL or None)
+    return info
+
+def _semantic_vectors(gen: IndexGeneration, start: int, stop: int) -> np.ndarray:
+    """Float32 vectors [start, stop) of a generation (base rows only if the base is flat)."""
+    base = gen.semantic_base
+    parts = []
+    if start < base.ntotal:
+        parts.append(base.reconstruct_n(start, min(stop, base.ntotal) - start))
+    offset = int(base.ntotal)
+    for chunk in gen.semantic_chunks:
+        lo, hi = max(start, offset), min(stop, offset + chunk.ntotal)
+        if lo < hi:
+            parts.append(chunk.reconstruct_n(lo - offset, hi - lo))
+        offset += int(chunk.ntotal)
+    return np.vstack(parts) if parts else np.zeros((0, base.d), dtype="float32")
+
+def _semantic_rows(gen: IndexGeneration, ids: np.ndarray) -> np.ndarray:
+    """Float32 vectors of the given sorted global ids, gathered from the base and the chunks."""
+    parts, offset = [], 0
+    for part in (gen.semantic_base,) + tuple(gen.semantic_chunks):
+        local = ids[(ids >= offset) & (ids < offset + part.ntotal)] - offset
+        if len(local):
+            parts.append(part.reconstruct_batch(local))
+        offset += int(part.ntotal)
+    return np.vstack(parts)
+
+def _add_semantic_chunk(chunks: Tuple, vectors: np.ndarray) -> Tuple:
+    """Chunks of the next generation: the current ones plus a new flat chunk (never mutated)."""
+    chunk = faiss.IndexFlatIP(vectors.shape[1])
+    chunk.add(vectors)
+    chunks = chunks + (chunk,)
+    if len(chunks) > SEMANTIC_MAX_CHUNKS:
+        merged = faiss.IndexFlatIP(vectors.shape[1])
+        for c in chunks:
+            merged.add(c.reconstruct_n(0, c.ntotal))
+        chunks = (merged,)
+    return chunks
+
+_semantic_upgrade_lock = threading.Lock()
+_semantic_upgrade_thread: Optional[threading.Thread] = None
+
+def _maybe_upgrade_semantic_index():
+    """
+    Start a background rebuild of the semantic base once the flat index has grown past the ANN
+    threshold, or once the incremental chunks are due to be folded into it.
+    """
+    global _semantic_upgrade_thread
+    gen = index_generation
+    base = gen.semantic_base
+    if base is None or _semantic_upgrade_lock.locked():
+        return
+    n = gen.semantic_ntotal
+    to_ann = isinstance(base, faiss.IndexFlat) and n >= SEMANTIC_ANN_THRESHOLD and _semantic_factory_string(n) != "Flat"
+    fold = n - base.ntotal >= max(SEMANTIC_DELTA_MIN_MERGE, SEMANTIC_DELTA_MERGE_RATIO * base.ntotal)
+    if not (to_ann or fold):
+        return
+    _semantic_upgrade_thread = threading.Thread(target=_upgrade_semantic_index, name="semantic-ann-build", daemon=True)
+    _semantic_upgrade_thread.start()
+
+def _upgrade_semantic_index():
+    """
+    Build the next semantic base in the background and publish it as a new generation:
+    - a flat base past SEMANTIC_ANN_THRESHOLD becomes the configured ANN/quantized index
+      (IVF/PQ/SQ8 trained on a sample of the base);
+    - otherwise the incremental chunks are folded into a copy of the base.
+    Vectors come from a snapshot generation, which is immutable, so the copy runs without the
+    index lock while queries and live adds carry on. Whatever was added meanwhile is caught up
+    under the lock right before publishing, so the rows keep matching passage_offsets throughout.
+    Exact top-10 neighbours of sampled corpus vectors are accumulated from the same chunks, so
+    an ANN index's recall@10 is measured without a second pass over the float32 vectors.
+    """
+    if not _semantic_upgrade_lock.acquire(blocking=False):
+        return
+    try:
+        snapshot = index_generation
+        base = snapshot.semantic_base
+        n = snapshot.semantic_ntotal
+        started = time.time()
+        spec = _semantic_factory_string(n)
+        to_ann = isinstance(base, faiss.IndexFlat) and n >= SEMANTIC_ANN_THRESHOLD and spec != "Flat"
+
+        if not to_ann:
+            print(f"🧭 Folding {n - base.ntotal} recent vectors into the semantic index...")
+            index = faiss.clone_index(base)
+            index.add(_semantic_vectors(snapshot, int(base.ntotal), n))
+            add_chunk = lambda chunk, first: index.add(chunk)
+        else:
+            print(f"🧭 Building {spec} semantic index over {n} vectors...")
+            index = faiss.index_factory(base.d, spec, faiss.METRIC_INNER_PRODUCT)
+            if isinstance(index, faiss.IndexHNSW):
+                index.hnsw.efConstruction = SEMANTIC_EF_CONSTRUCTION
+
+            rng = np.random.default_rng(0)
+            if not index.is_trained:
+                ivf = faiss.try_extract_index_ivf(index)
+                size = min(n, max(SEMANTIC_TRAIN_SAMPLE, 40 * ivf.nlist if ivf is not None else 0))
+                train = _semantic_rows(snapshot, np.sort(rng.choice(n, size=size, replace=False)))
+                index.train(train)
+                del train
+
+            queries = _semantic_rows(snapshot, np.sort(rng.choice(n, size=min(n, SEMANTIC_RECALL_QUERIES), replace=False)))
+            k = min(10, n)
+            exact_scores = np.full((len(queries), k), -np.inf, dtype="float32")
+            exact_ids = np.full((len(queries), k), -1, dtype="int64")
+
+            def add_chunk(chunk: np.ndarray, first: int):
+                nonlocal exact_scores, exact_ids
+                index.add(chunk)
+                cand_scores = np.hstack([exact_scores, queries @ chunk.T])
+                cand_ids = np.hstack([exact_ids, np.broadcast_to(np.arange(first, first + len(chunk)), (len(queries), len(chunk)))])
+                top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+                exact_scores = np.take_along_axis(cand_scores, top, axis=1)
+                exact_ids = np.take_along_axis(cand_ids, top, axis=1)
+
+            for done in range(0, n, 16 * EMBED_PROGRESS_CHUNK):
+                add_chunk(_semantic_vectors(snapshot, done, min(done + 16 * EMBED_PROGRESS_CHUNK, n)), done)
+
+        with _index_lock:
+            current = index_generation
+            if current.docs is not snapshot.docs or current.semantic_base is not base:
+                print("⚠️ Corpus was replaced during the semantic index build — discarding it")
+                return
+            # Last stretch: catch up and publish without letting more adds slip in
+            if current.semantic_ntotal > n:
+                add_chunk(_semantic_vectors(current, n, current.semantic_ntotal), n)
+            _publish_generation(current.next(semantic_base=_tune_semantic_index(index), semantic_chunks=()))
+
+        if not to_ann:
+            print(f"✅ Semantic index now holds {index.ntotal} vectors in one {_semantic_index_kind(index)} index "
+                  f"({time.time() - started:.1f}s)")
+            return
+        recall = lambda ids: float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact_ids)]))
+        SEMANTIC_RECALL.clear()
+        SEMANTIC_RECALL.update({
+            "spec": spec,
+            "recall_at_10": round(recall(index.search(queries, k)[1]), 4),
+            "recall_at_10_rescored": round(recall(_semantic_search(index, queries, k, snapshot)[1]), 4),
+            "queries": len(queries),
+        })
+        print(f"✅ Semantic index switched to {spec} ({index.ntotal} vectors, {_semantic_code_size(index)} B/vector, "
+              f"recall@10 {SEMANTIC_RECALL['recall_at_10']:.3f} / {SEMANTIC_RECALL['recall_at_10_rescored']:.3f} "
+              f"rescored, {time.time() - started:.1f}s)")
+    except Exception as e:
+        print(f"⚠️ Semantic index build failed, keeping the current index: {e}")
+    finally:
+        _semantic_upgrade_lock.release()
+
+def _load_semantic_index(index=None):
+    """Load the embedder and publish a FAISS index that is up to date with the current docs."""
+    global embedder, embedding_cache
+
+    print("🤖 Initializing RAG system...")
+    embedding_cache = EmbeddingCache(EMBED_CACHE_DIR, EMBED_MODEL_NAME)
+    embedder = SentenceTransformer(EMBED_MODEL_NAME)
+
+    # The bundle may already provide vectors for a prefix of docs (and their passage offsets);
+    # only the rest is embedded
+    with _index_lock:
+        gen = index_generation
+        start, stop = (gen.semantic_docs, gen.n_docs) if index is not None else (0, gen.n_docs)
+        offsets = array("q", gen.passage_offsets[:start + 1])
+    if index is None:
+        index = faiss.IndexFlatIP(embedder.get_sentence_embedding_dimension())
+        # Creates FAISS index for fast similarity search
+        # Uses: Cosine similarity (normalized dot product)
+        # Starts exact; _maybe_upgrade_semantic_index() moves it to SEMANTIC_INDEX_MODE once large enough
+
+    # Embed outside the lock so live-fallback appends are not blocked for minutes
+    # (the index is not published yet, so nothing reads it meanwhile)
+    STARTUP_STATE["embed_total"] = stop - start
+    for chunk_start in range(start, stop, EMBED_PROGRESS_CHUNK):
+        chunk_stop = min(chunk_start + EMBED_PROGRESS_CHUNK, stop)
+        index.add(_encode_texts(_doc_passages(gen.docs, chunk_start, chunk_stop, offsets)))
+        STARTUP_STATE["embedded"] = chunk_stop - start
+
+    # Catch up on docs appended meanwhile, then publish
+    with _index_lock:
+        current = index_generation
+        if stop < current.n_docs:
+            index.add(_encode_texts(_doc_passages(current.docs, stop, current.n_docs, offsets)))
+        _publish_generation(current.next(semantic_base=_tune_semantic_index(index), semantic_chunks=(),
+                                         passage_offsets=offsets, semantic_docs=current.n_docs))
+
+    print(f"💾 Embedding cache: {embedding_cache.hits} reused, {embedding_cache.misses} newly encoded")
+    print(f"✅ Semantic index ready with {index.ntotal} passages of {current.n_docs} docs")
+
+# ====================== QUERY CACHES ======================
+class BoundedLRU:
+    """
+    Thread-safe LRU bounded by entry count and approximate size in bytes.
+    Entries can carry a TTL; expired entries count as misses and are dropped on access.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, sizeof=sys.getsizeof):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._items: "OrderedDict[Any, Tuple[Any, float, int]]" = OrderedDict()   # key -> (value, expires, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] and item[1] < time.time():
+                self._drop(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, ttl: Optional[float] = None):
+        size = self.sizeof(key) + self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (value, time.time() + ttl if ttl else 0.0, size)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._items)))
+
+    def _drop(self, key):
+        self._bytes -= self._items.pop(key)[2]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+# ---------------------- PATCH: query embeddings ----------------------
+QUERY_EMBED_CACHE_SIZE = int(os.environ.get("QUERY_EMBED_CACHE_SIZE", "10000"))
+QUERY_EMBED_CACHE_MB = int(os.environ.get("QUERY_EMBED_CACHE_MB", "64"))
+
+query_embedding_cache = BoundedLRU(QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_MB << 20,
+                                   sizeof=lambda v: v.nbytes if isinstance(v, np.ndarray) else sys.getsizeof(v))
+# normalized question -> (1, dim) float32 embedding, shared by semantic_match and /debug-match
+
+def _normalize_query(question: str) -> str:
+    """Case/whitespace-insensitive cache key (the mpnet tokenizer lowercases anyway)."""
+    return " ".join((question or "").lower().split())
+
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.environ.get("QUERY_BATCH_MAX_WAIT_MS", "3"))
+# Concurrent query encodes are collected for up to this long / this many items and run as one batch
+
+class QueryEmbeddingBatcher:
+    """
+    Dynamic micro-batcher in front of the embedder. Callers get a Future; one worker thread takes
+    the first waiting query, gathers whatever else arrives within QUERY_BATCH_MAX_WAIT_MS (up to
+    QUERY_BATCH_MAX_SIZE), encodes the distinct texts in a single embedder.encode call and fans
+    the rows back out. A lone query waits at most max_wait; under load mpnet runs full batches.
+    """
+
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.peak_queue_depth = 0
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future))
+        self.peak_queue_depth = max(self.peak_queue_depth, self._queue.qsize())
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-embed-batcher", daemon=True)
+                    self._thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            until = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = until - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._encode_batch(batch)
+            except Exception as e:   # never let the only worker die: later queries would wait forever
+                print(f"⚠️ Query embedding batch failed: {e}")
+
+    def _encode_batch(self, batch: List[Tuple[str, Future]]):
+        # Callers that gave up (cancelled, e.g. past their deadline) are dropped; the rest can no
+        # longer be cancelled, so resolving them below cannot fail
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embs = np.asarray(embedder.encode(texts, normalize_embeddings=True, batch_size=len(texts)), dtype="float32")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        rows = {text: i for i, text in enumerate(texts)}
+        for text, future in batch:
+            emb = embs[rows[text]:rows[text] + 1].copy()
+            emb.setflags(write=False)
+            future.set_result(emb)
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queue_depth": self._queue.qsize(), "peak_queue_depth": self.peak_queue_depth,
+                "batches": self.batches, "items": self.items, "largest_batch": self.largest_batch,
+                "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "max_batch": self.max_batch, "max_wait_ms": self.max_wait * 1000.0}
+
+query_embed_batcher = QueryEmbeddingBatcher(QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS)
+
+def _embed_query_future(question: str) -> Future:
+    """Future of the normalized query embedding: resolved at once on a cache hit, else micro-batched."""
+    key = _normalize_query(question)
+    emb = query_embedding_cache.get(key)
+    if emb is not None:
+        future: Future = Future()
+        future.set_result(emb)
+        return future
+    def remember(f: Future):
+        if not f.cancelled() and f.exception() is None:
+            query_embedding_cache.put(key, f.result())
+
+    future = query_embed_batcher.submit(key)
+    future.add_done_callback(remember)
+    return future
+
+def _embed_query(question: str, deadline: Optional[float] = None) -> np.ndarray:
+    """
+    Normalized query embedding; repeated phrasings skip the transformer entirely.
+    Waits until `deadline` (default: a fresh request budget), then gives up with TimeoutError.
+    """
+    future = _embed_query_future(question)
+    try:
+        return future.result(timeout=max(0.0, (deadline or _request_deadline()) - time.time()))
+    except FutureTimeoutError:
+        future.cancel()   # the batcher skips it if it has not started yet
+        raise
+
+# ---------------------- PATCH: answer cache ----------------------
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "20000"))
+ANSWER_CACHE_MB = int(os.environ.get("ANSWER_CACHE_MB", "128"))
+ANSWER_CACHE_TTLS = {
+    # seconds per result method; local answers only change when the corpus does
+    "exact_source": 6 * 3600, "exact_topic": 6 * 3600, "keyword": 6 * 3600, "semantic": 6 * 3600,
+    "live_wikipedia": 3600, "live_stackoverflow": 3600, "live_arxiv": 3600, "live_github_code": 1800,
+    "live_reddit": 300, "live_youtube": 300,
+    # "none" is not cached here: per-source misses are remembered by live_miss_cache instead
+}
+
+answer_cache = BoundedLRU(ANSWER_CACHE_SIZE, ANSWER_CACHE_MB << 20,
+                          sizeof=lambda v: sys.getsizeof(v) + (len(v.get("text") or "") if isinstance(v, dict) else 0))
+# (index generation number, clean_question(question)) -> result dict; older generations just age out
+
+
+# ---------------------- PATCH: request deadline ----------------------
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "12"))
+# Default time budget per question, below Laravel's 15s askRAGMicroservice timeout. Callers can
+# override it with the `deadline` field or an `X-Request-Deadline` header (seconds).
+SEMANTIC_MIN_BUDGET = 0.05
+# The semantic tier (query embedding + FAISS) is skipped with less than this many seconds left
+
+def _request_deadline(field: Optional[float] = None, header: Optional[float] = None) -> float:
+    """Absolute deadline (time.time() based) for a request; the body field wins over the header."""
+    budget = next((b for b in (field, header) if b is not None and b > 0), REQUEST_DEADLINE_SECONDS)
+    return time.time() + budget
 
 class Query(BaseModel):
     question: str
+    deadline: Optional[float] = None  # seconds the caller will wait (default REQUEST_DEADLINE_SECONDS)
+
+class BatchQuery(BaseModel):
+    questions: List[str]
+    deadline: Optional[float] = None  # for the whole batch
+    stream: bool = False              # NDJSON, one line per question in order, sent as soon as ready
 
 # Common stop words to ignore / Improves accuracy by filtering out meaningless words
 STOP_WORDS = {
@@ -185,11 +1749,12 @@ def extract_keywords(question: str) -> List[str]:
 def exact_source_match(question: str) -> Optional[Dict]:
     """Check for exact source/topic match (HIGHEST CONFIDENCE)"""
     clean_q = clean_question(question)
+    gen = index_generation
     
     # Try direct source match (e.g., "wikipedia-artificial-intelligence")
     source_key = f"wikipedia-{clean_q.replace(' ', '-')}"
-    if source_key in source_index:
-        doc = source_index[source_key]
+    if source_key in gen.source_index:
+        doc = gen.docs[gen.source_index[source_key]]
         return {
             "text": doc["text"],
             "source": doc.get("source", ""),
@@ -199,8 +1764,8 @@ def exact_source_match(question: str) -> Optional[Dict]:
         }
     
     # Try topic match (e.g., "artificial intelligence")
-    if clean_q in topic_index:
-        doc = topic_index[clean_q]
+    if clean_q in gen.topic_index:
+        doc = gen.docs[gen.topic_index[clean_q]]
         return {
             "text": doc["text"],
             "source": doc.get("source", ""),
@@ -213,28 +1778,21 @@ def exact_source_match(question: str) -> Optional[Dict]:
 
 # Tier 2: Keyword Match (Medium Priority)
 def keyword_match(question: str) -> Optional[Dict]:
-    """Keyword-based matching with scoring"""
+    """Keyword-based matching: BM25 ranking, confidence from keyword coverage of the best doc"""
     keywords = extract_keywords(question)
     
     if not keywords:
         return None
     
-    # Score documents based on keyword matches
-    doc_scores = defaultdict(float)
-    doc_keyword_counts = defaultdict(set)
-    
-    for keyword in keywords:
-        if keyword in keyword_index:
-            for doc_idx in keyword_index[keyword]:
-                doc_scores[doc_idx] += 1.0
-                doc_keyword_counts[doc_idx].add(keyword)
+    # Rank documents with BM25 (rare terms and short docs weigh more)
+    gen = index_generation
+    hits = gen.keyword_index.search(keywords, k=KEYWORD_TOP_K)
     
-    if not doc_scores:
+    if not hits:
         return None
     
-    # Find best match
-    best_idx = max(doc_scores.items(), key=lambda x: x[1])[0]
-    matched_keywords = len(doc_keyword_counts[best_idx])
+    # Best match
+    bm25_score, best_idx, matched_keywords = hits[0]
     total_keywords = len(keywords)
     
     # Calculate normalized score (0-1)
@@ -245,9 +1803,10 @@ def keyword_match(question: str) -> Optional[Dict]:
         confidence = min(keyword_score * 1.5, 1.0)  # Scale to 0-1
         
         return {
-            "text": docs[best_idx]["text"],
-            "source": docs[best_idx].get("source", ""),
+            "text": gen.docs[best_idx]["text"],
+            "source": gen.docs[best_idx].get("source", ""),
             "score": confidence,
+            "bm25": round(bm25_score, 4),
             "method": "keyword",
             "confidence": "high" if confidence > 0.7 else "medium"
         }
@@ -255,35 +1814,112 @@ def keyword_match(question: str) -> Optional[Dict]:
     return None
 
 # Tier 3: Semantic Match (Fallback)
-def semantic_match(question: str) -> Optional[Dict]:
+def semantic_match(question: str, question_emb: Optional[np.ndarray] = None) -> Optional[Dict]:
     """Semantic similarity search with strict thresholds"""
+    gen = index_generation
+    if not gen.semantic_ready:
+        return None  # still loading; exact/keyword tiers already serve
     try:
-        question_emb = embedder.encode([question], normalize_embeddings=True)
-        scores, indices = semantic_index.search(question_emb.astype('float32'), k=5)
-        
-        best_score = 0
-        best_match = None
-        
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if 0 <= idx < len(docs):
-                if score > 0.6 and score > best_score:  # Higher threshold
-                    best_score = score
-                    best_match = {
-                        "text": docs[idx]["text"],
-                        "source": docs[idx].get("source", ""),
-                        "score": float(score),
-                        "method": "semantic",
-                        "confidence": "high" if score > 0.75 else "medium"
-                    }
-        
-        return best_match
+        if question_emb is None:
+            question_emb = _embed_query(question)
+        scores, indices = gen.search_semantic(question_emb, k=5)
+        return _best_semantic_hit(gen, scores[0], indices[0])
     
     except Exception as e:
         print(f"Semantic search error: {e}")
         return None
 
+def _best_semantic_hit(gen: IndexGeneration, scores: np.ndarray, indices: np.ndarray) -> Optional[Dict]:
+    """Best doc of one row of `gen`'s FAISS results, if it clears the semantic threshold."""
+    best_score = 0
+    best_match = None
+    
+    for i, (score, idx) in enumerate(zip(scores, indices)):
+        if 0 <= idx < gen.n_docs:
+            if score > 0.6 and score > best_score:  # Higher threshold
+                best_score = score
+                best_match = {
+                    "text": gen.docs[idx]["text"],
+                    "source": gen.docs[idx].get("source", ""),
+                    "score": float(score),
+                    "method": "semantic",
+                    "confidence": "high" if score > 0.75 else "medium"
+                }
+    
+    return best_match
+
+SEMANTIC_BATCH_CHUNK = 64
+# semantic_match_batch encodes and searches this many questions at a time, checking the deadline in between
+
+def semantic_match_batch(questions: List[str], deadline: Optional[float] = None) -> Tuple[List[Optional[Dict]], List[int]]:
+    """
+    semantic_match for many questions: cached embeddings are reused, the rest are encoded and
+    searched SEMANTIC_BATCH_CHUNK questions per embedder.encode / FAISS call. Each chunk is only
+    started with at least SEMANTIC_MIN_BUDGET left before `deadline`.
+    Returns (results, cut): positions of the questions the budget did not cover are in `cut`.
+    """
+    gen = index_generation
+    results: List[Optional[Dict]] = [None] * len(questions)
+    if not questions or not gen.semantic_ready:
+        return results, []
+    has_budget = lambda: deadline is None or deadline - time.time() >= SEMANTIC_MIN_BUDGET
+    try:
+        keys = [_normalize_query(q) for q in questions]
+        embs = {k: query_embedding_cache.get(k) for k in dict.fromkeys(keys)}
+        missing = [k for k, emb in embs.items() if emb is None]
+        for start in range(0, len(missing), SEMANTIC_BATCH_CHUNK):
+            if not has_budget():
+                break
+            chunk = missing[start:start + SEMANTIC_BATCH_CHUNK]
+            fresh = np.asarray(embedder.encode(chunk, normalize_embeddings=True, batch_size=64), dtype="float32")
+            for k, row in zip(chunk, fresh):
+                emb = row[None, :].copy()
+                emb.setflags(write=False)
+                embs[k] = emb
+                query_embedding_cache.put(k, emb)
+
+        ready = [r for r, k in enumerate(keys) if embs[k] is not None]
+        searched = 0
+        for start in range(0, len(ready), SEMANTIC_BATCH_CHUNK):
+            if not has_budget():
+                break
+            rows = ready[start:start + SEMANTIC_BATCH_CHUNK]
+            scores, indices = gen.search_semantic(np.vstack([embs[keys[r]] for r in rows]), k=5)
+            for j, r in enumerate(rows):
+                results[r] = _best_semantic_hit(gen, scores[j], indices[j])
+            searched += len(rows)
+        covered = set(ready[:searched])
+        return results, [r for r in range(len(questions)) if r not in covered]
+    except Exception as e:
+        print(f"Semantic batch search error: {e}")
+        return results, []
+
 
 
+_live_call = threading.local()
+# Per-thread state of the live tier being run: `failed` is set by a tier that returned None because
+# of an error rather than no result; `cut` by a tier that gave up because the remaining budget was
+# too short (reported in cut_tiers, never cached as a miss); `cancel` is set once a higher-priority
+# tier has answered or the request ran out of time; `deadline` is the request's deadline (time.time() based);
+# `clipped` is set by _live_timeout when the budget, not the tier, chose an HTTP timeout
+
+def _live_cancelled() -> bool:
+    """True when the running live tier's answer can no longer be used (checked between HTTP calls)."""
+    cancel = getattr(_live_call, "cancel", None)
+    return cancel is not None and cancel.is_set()
+
+def _live_remaining() -> float:
+    """Seconds left in the current request's budget (infinite outside a request, e.g. bulk ingestion)."""
+    deadline = getattr(_live_call, "deadline", None)
+    return deadline - time.time() if deadline is not None else math.inf
+
+def _live_timeout(default: float) -> float:
+    """Outbound HTTP timeout: the tier's usual timeout, clipped to the remaining budget."""
+    remaining = _live_remaining()
+    if remaining < default:
+        _live_call.clipped = True
+    return max(0.1, min(default, remaining))
+
 def live_wikipedia_fallback(question: str) -> Optional[Dict]:
     clean_q = clean_question(question)
     keywords = set(extract_keywords(question))
@@ -299,7 +1935,7 @@ def live_wikipedia_fallback(question: str) -> Optional[Dict]:
     }
 
     try:
-        r = HTTP.get(API_SEARCH, params=params, timeout=30)
+        r = HTTP.get(API_SEARCH, params=params, timeout=_live_timeout(30))
         r.raise_for_status()
         data = r.json()
         search_results = data.get("query", {}).get("search", [])
@@ -319,10 +1955,14 @@ def live_wikipedia_fallback(question: str) -> Optional[Dict]:
 
             if len(matched) >= min(2, len(keywords)):  # at least 2 matches, or all if <2
                 print(f"Relevant Wikipedia page found: {result['title']}")
+                if _live_cancelled():
+                    return None
                 items = _wiki_fetch_pages([result["title"]])
                 if items:
                     doc = items[0]
-                    _append_items([doc])
+                    if _live_cancelled():
+                        return None
+                    ingest_queue.put([doc])   # indexed behind the response (write-behind)
                     return {
                         "text": doc["text"],
                         "source": doc["source"],
@@ -336,6 +1976,7 @@ def live_wikipedia_fallback(question: str) -> Optional[Dict]:
 
     except Exception as e:
         print(f"Live Wikipedia fallback failed: {e}")
+        _live_call.failed = True   # an error, not a real miss (see _run_live_tier)
         return None
 
 # Tier 4: Live Stack Overflow Fallback for coding questions
@@ -363,7 +2004,7 @@ def live_stackoverflow_fallback(question: str) -> Optional[Dict]:
     }
 
     try:
-        r = requests.get(search_url, params=params, timeout=30)
+        r = requests.get(search_url, params=params, timeout=_live_timeout(30))
         r.raise_for_status()
         data = r.json()
         items = data.get("items", [])
@@ -395,7 +2036,9 @@ def live_stackoverflow_fallback(question: str) -> Optional[Dict]:
             "site": "stackoverflow",
             "filter": "withbody"  # includes answer.body
         }
-        ra = requests.get(answers_url, params=answers_params, timeout=30)
+        if _live_cancelled():
+            return None
+        ra = requests.get(answers_url, params=answers_params, timeout=_live_timeout(30))
         ra.raise_for_status()
         answers_data = ra.json()
         answers = answers_data.get("items", [])
@@ -424,7 +2067,9 @@ def live_stackoverflow_fallback(question: str) -> Optional[Dict]:
         full_text = "\n".join(text_parts)[:10000]  # limit size
 
         doc = {"text": full_text, "source": link}
-        _append_items([doc])
+        if _live_cancelled():
+            return None
+        ingest_queue.put([doc])
 
         return {
             "text": full_text,
@@ -436,6 +2081,7 @@ def live_stackoverflow_fallback(question: str) -> Optional[Dict]:
 
     except Exception as e:
         print(f"Stack Overflow fallback failed: {e}")
+        _live_call.failed = True   # an error, not a real miss (see _run_live_tier)
         return None
 
 # Tier 6: Live Reddit Search
@@ -453,7 +2099,7 @@ def live_reddit_fallback(question: str) -> Optional[Dict]:
             "raw_json": 1
         }
         headers = {"User-Agent": "PythonAIService/1.0 (local RAG bot)"}
-        r = requests.get(search_url, params=params, headers=headers, timeout=30)
+        r = requests.get(search_url, params=params, headers=headers, timeout=_live_timeout(30))
         r.raise_for_status()
         data = r.json()
         posts = data.get("data", {}).get("children", [])
@@ -473,7 +2119,9 @@ def live_reddit_fallback(question: str) -> Optional[Dict]:
         full_text = "\n".join(text_parts)
         
         doc = {"text": full_text, "source": f"reddit_search:{clean_q}"}
-        _append_items([doc])
+        if _live_cancelled():
+            return None
+        ingest_queue.put([doc])
         
         return {
             "text": full_text,
@@ -484,6 +2132,7 @@ def live_reddit_fallback(question: str) -> Optional[Dict]:
         }
     except Exception as e:
         print(f"Reddit fallback failed: {e}")
+        _live_call.failed = True   # an error, not a real miss (see _run_live_tier)
         return None
 
 # Tier 7: GitHub Code Search (public repos)
@@ -498,10 +2147,15 @@ def live_github_code_fallback(question: str) -> Optional[Dict]:
         search_url = "https://api.github.com/search/code"
         params = {"q": clean_q}
         headers = {"Accept": "application/vnd.github.v3+json", "User-Agent": "PythonAIService"}
-        r = requests.get(search_url, params=params, headers=headers, timeout=30)
+        r = requests.get(search_url, params=params, headers=headers, timeout=_live_timeout(30))
         if r.status_code == 403:  # rate limit
+            if _live_remaining() < 15:
+                _live_call.cut = True   # no budget left for the back-off + retry: not a miss
+                return None
             time.sleep(10)
-            r = requests.get(search_url, params=params, headers=headers, timeout=30)
+            if _live_cancelled():
+                return None
+            r = requests.get(search_url, params=params, headers=headers, timeout=_live_timeout(30))
         r.raise_for_status()
         data = r.json()
         items = data.get("items", [])[:3]
@@ -518,7 +2172,9 @@ def live_github_code_fallback(question: str) -> Optional[Dict]:
         
         full_text = "\n".join(text_parts)
         doc = {"text": full_text, "source": f"github_code:{clean_q}"}
-        _append_items([doc])
+        if _live_cancelled():
+            return None
+        ingest_queue.put([doc])
         
         return {
             "text": full_text,
@@ -529,6 +2185,7 @@ def live_github_code_fallback(question: str) -> Optional[Dict]:
         }
     except Exception as e:
         print(f"GitHub code fallback failed: {e}")
+        _live_call.failed = True   # an error, not a real miss (see _run_live_tier)
         return None
 
 # Tier 8: ArXiv Research Papers
@@ -545,7 +2202,7 @@ def live_arxiv_fallback(question: str) -> Optional[Dict]:
             "sortBy": "relevance",
             "sortOrder": "descending"
         }
-        r = requests.get(search_url, params=params, timeout=30)
+        r = requests.get(search_url, params=params, timeout=_live_timeout(30))
         r.raise_for_status()
         
         import feedparser
@@ -564,7 +2221,9 @@ def live_arxiv_fallback(question: str) -> Optional[Dict]:
         
         full_text = "\n".join(text_parts)
         doc = {"text": full_text, "source": f"arxiv:{clean_q}"}
-        _append_items([doc])
+        if _live_cancelled():
+            return None
+        ingest_queue.put([doc])
         
         return {
             "text": full_text,
@@ -575,6 +2234,7 @@ def live_arxiv_fallback(question: str) -> Optional[Dict]:
         }
     except Exception as e:
         print(f"arXiv fallback failed: {e}")
+        _live_call.failed = True   # an error, not a real miss (see _run_live_tier)
         return None
 
 # Tier 9: YouTube Transcripts
@@ -587,7 +2247,7 @@ def live_youtube_fallback(question: str) -> Optional[Dict]:
         search_url = "https://www.youtube.com/results"
         params = {"search_query": clean_q}
         headers = {"User-Agent": "PythonAIService/1.0"}
-        r = requests.get(search_url, params=params, headers=headers, timeout=30)
+        r = requests.get(search_url, params=params, headers=headers, timeout=_live_timeout(30))
         r.raise_for_status()
         
         # Extract first video ID (simple regex - works reliably)
@@ -598,6 +2258,8 @@ def live_youtube_fallback(question: str) -> Optional[Dict]:
         video_url = f"https://www.youtube.com/watch?v={video_id}"
         
         # Get transcript
+        if _live_cancelled():
+            return None
         from youtube_transcript_api import YouTubeTranscriptApi
         transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
         transcript = transcript_list.find_generated_transcript(['en']) or transcript_list.find_transcript(['en'])
@@ -607,7 +2269,9 @@ def live_youtube_fallback(question: str) -> Optional[Dict]:
         full_text = f"YouTube video transcript:\n\n{full_text[:10000]}...\n\nSource: {video_url}"
         
         doc = {"text": full_text, "source": video_url}
-        _append_items([doc])
+        if _live_cancelled():
+            return None
+        ingest_queue.put([doc])
         
         return {
             "text": full_text,
@@ -618,6 +2282,7 @@ def live_youtube_fallback(question: str) -> Optional[Dict]:
         }
     except Exception as e:
         print(f"YouTube fallback failed: {e}")
+        _live_call.failed = True   # an error, not a real miss (see _run_live_tier)
         return None
 
 # ---------------------- PATCH: GitHub Token for higher rate limits ----------------------
@@ -630,10 +2295,184 @@ headers = {
     "User-Agent": "PythonAIService"
 }
 
+# ---------------------- PATCH: live tiers (concurrent + negative cache) ----------------------
+LIVE_TIERS = [
+    # Priority order: the first tier with an answer wins (Stack Overflow FIRST for coding questions)
+    ("stackoverflow", live_stackoverflow_fallback),   # Tier 4
+    ("github_code", live_github_code_fallback),       # Tier 5
+    ("wikipedia", live_wikipedia_fallback),           # Tier 6 (now safer with relevance check)
+    ("arxiv", live_arxiv_fallback),                   # Tier 7 (research)
+    ("reddit", live_reddit_fallback),                 # Tier 8
+    ("youtube", live_youtube_fallback),               # Tier 9
+]
+
+LIVE_TIER_WORKERS = int(os.environ.get("LIVE_TIER_WORKERS", "32"))
+live_tier_pool = ThreadPoolExecutor(max_workers=LIVE_TIER_WORKERS, thread_name_prefix="live-tier")
+# Shared by all requests; each miss occupies up to len(LIVE_TIERS) workers
+
+LIVE_MIN_BUDGET = 1.0
+# Live tiers are not started with less than this many seconds left in the request budget
+
+LIVE_MISS_ERROR_TTL = 60
+# Sources that failed (timeout, HTTP error) are only skipped briefly, then retried
+
+LIVE_MISS_CACHE_SIZE = int(os.environ.get("LIVE_MISS_CACHE_SIZE", "50000"))
+LIVE_MISS_CACHE_MB = int(os.environ.get("LIVE_MISS_CACHE_MB", "16"))
+LIVE_MISS_TTLS = {
+    # seconds a source that found nothing is skipped for the same question
+    "stackoverflow": 6 * 3600, "github_code": 6 * 3600, "wikipedia": 6 * 3600, "arxiv": 6 * 3600,
+    "reddit": 1800, "youtube": 1800,
+}
+
+live_miss_cache = BoundedLRU(LIVE_MISS_CACHE_SIZE, LIVE_MISS_CACHE_MB << 20)
+# (source name, clean_question(question)) -> True while that source is known to have nothing
+
+def _run_live_tier(name: str, fallback, question: str, cancel: threading.Event,
+                   deadline: float) -> Tuple[Optional[Dict], bool]:
+    """
+    Run one live tier (in a worker thread) and remember the miss if it found nothing.
+    Returns (result, cut); cut tiers ran out of budget, so their None is not a miss.
+    """
+    _live_call.failed, _live_call.cut, _live_call.clipped = False, False, False
+    _live_call.cancel, _live_call.deadline = cancel, deadline
+    try:
+        result = fallback(question)
+    except Exception as e:
+        print(f"{name} fallback crashed: {e}")
+        result, _live_call.failed = None, True
+    finally:
+        _live_call.cancel = _live_call.deadline = None
+    # An error once this request's budget (not the tier's own timeout) ran out is this caller's
+    # timeout, not the source's: report it as cut rather than hiding the source from everyone
+    cut = _live_call.cut or (_live_call.failed and _live_call.clipped and time.time() >= deadline - 0.1)
+    if not result and not cancel.is_set() and not cut:
+        ttl = LIVE_MISS_ERROR_TTL if _live_call.failed else LIVE_MISS_TTLS.get(name, 1800)
+        live_miss_cache.put((name, clean_question(question)), True, ttl=ttl)
+    return result, cut
+
+async def _find_live_answer(question: str, deadline: float, cut_tiers: List[str]) -> Optional[Dict]:
+    """
+    Launch every live tier that has not recently missed this question at once, then take the
+    first answer in priority order: tier i wins as soon as tiers 0..i-1 have all come back empty.
+    At the deadline unfinished tiers can no longer win, so the best finished answer is used and
+    the rest are added to `cut_tiers`.
+    Losers are cancelled (queued ones never start, running ones stop before their next HTTP call
+    and do not append), so a miss costs about the slowest source instead of the sum.
+    The blocking tiers run in live_tier_pool; the event loop only awaits their futures.
+    """
+    clean_q = clean_question(question)
+    eligible = []
+    for name, fallback in LIVE_TIERS:
+        if live_miss_cache.get((name, clean_q)):
+            print(f"Skipping {name} (no result for this question recently)")
+        else:
+            eligible.append((name, fallback))
+    if not eligible:
+        return None
+    if deadline - time.time() < LIVE_MIN_BUDGET:
+        cut_tiers.extend(name for name, _ in eligible)
+        print(f"⏱️ No budget left for live tiers ({', '.join(cut_tiers)})")
+        return None
+
+    print(f"Trying {', '.join(name for name, _ in eligible)} concurrently...")
+    cancel = threading.Event()
+    futures = [asyncio.wrap_future(live_tier_pool.submit(_run_live_tier, name, fallback, question, cancel, deadline))
+               for name, fallback in eligible]
+    try:
+        for i, future in enumerate(futures):
+            done, _ = await asyncio.wait([future], timeout=max(0.0, deadline - time.time()))
+            if not done:
+                # Out of time: take the best answer that did finish, report the rest as cut
+                pending = list(zip(eligible[i:], futures[i:]))
+                cut_tiers.extend(name for (name, _), f in pending if not f.done() or f.result()[1])
+                print(f"⏱️ Deadline reached, cut live tiers: {', '.join(cut_tiers)}")
+                return next((f.result()[0] for _, f in pending if f.done() and f.result()[0]), None)
+            result, cut = future.result()
+            if cut:
+                cut_tiers.append(eligible[i][0])
+            if result:
+                return result
+        return None
+    finally:
+        cancel.set()
+        for future in futures:
+            future.cancel()   # propagates to the pool future, so queued tiers never start
+
+# ---------------------- PATCH: retrieval executor ----------------------
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", "4"))
+retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+# Bounded pool for the CPU-heavy local tiers (BM25 scoring, FAISS search), so the event loop never
+# runs them itself; faiss/numpy release the GIL while they compute. Query embeddings come from the
+# micro-batcher's own thread.
+
+async def _in_retrieval_pool(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(retrieval_pool, fn, *args)
+
+async def _semantic_match_async(question: str, deadline: Optional[float] = None,
+                                cut_tiers: Optional[List[str]] = None) -> Optional[Dict]:
+    """
+    semantic_match with the query embedding awaited from the micro-batcher (no worker held meanwhile).
+    An embedding that is not ready by `deadline` cuts the tier (the queued encode is cancelled).
+    """
+    if not index_generation.semantic_ready:
+        return None
+    deadline = deadline or _request_deadline()
+    try:
+        question_emb = await asyncio.wait_for(asyncio.wrap_future(_embed_query_future(question)),
+                                              timeout=max(0.0, deadline - time.time()))
+    except asyncio.TimeoutError:
+        print("⏱️ Query embedding not ready before the deadline — cutting the semantic tier")
+        if cut_tiers is not None:
+            cut_tiers.append("semantic")
+        return None
+    except Exception as e:
+        print(f"Semantic search error: {e}")
+        return None
+    return await _in_retrieval_pool(semantic_match, question, question_emb)
+
 # 🤝 Orchestrator Function
-def find_best_answer(question: str) -> Dict:
+async def find_best_answer(question: str, deadline: Optional[float] = None) -> Dict:
+    """
+    Answer from the answer cache when the corpus has not changed since, else run the tiers
+    within `deadline` (absolute, see _request_deadline; defaults to REQUEST_DEADLINE_SECONDS).
+    Coroutine: exact lookups run inline, keyword/semantic work in retrieval_pool and live tiers
+    in live_tier_pool, so one slow source never stalls other requests on the worker.
+    """
+    start_time = time.time()
+    clean_q = clean_question(question)
+    generation = index_generation.number
+    cached = _cached_answer(generation, clean_q, start_time)
+    if cached is not None:
+        return cached
+
+    result = await _find_best_answer_uncached(question, deadline or _request_deadline())
+    _remember_answer(generation, clean_q, result)
+    return result
+
+def _cached_answer(generation: int, clean_q: str, start_time: float) -> Optional[Dict]:
+    cached = answer_cache.get((generation, clean_q))
+    if cached is None:
+        return None
+    result = dict(cached)
+    result["search_time"] = time.time() - start_time
+    result["cached"] = True
+    return result
+
+def _remember_answer(generation: int, clean_q: str, result: Dict):
+    """Cache a fresh answer under the index generation it was computed against."""
+    ttl = ANSWER_CACHE_TTLS.get(result.get("method"))
+    if ttl and not result.get("cut_tiers"):   # a cut tier might have answered better
+        # Live answers do not depend on the corpus, so they are filed under the current generation;
+        # once the write-behind queue has indexed the doc the generation moves on and the local
+        # tiers answer from it
+        if result["method"].startswith("live_"):
+            generation = index_generation.number
+        answer_cache.put((generation, clean_q), dict(result), ttl=ttl)
+
+async def _find_best_answer_uncached(question: str, deadline: float) -> Dict:
     """Find best answer using multiple strategies with strict thresholds + live fallback"""
     start_time = time.time()
+    cut_tiers: List[str] = []   # tiers skipped or abandoned because the deadline was too close
 
     # === Tier 1: Exact source/topic match ===
     exact_result = exact_source_match(question)
@@ -642,127 +2481,191 @@ def find_best_answer(question: str) -> Dict:
         return exact_result  # highest priority
 
     # === Tier 2: Keyword match ===
-    keyword_result = keyword_match(question)
+    keyword_result = await _in_retrieval_pool(keyword_match, question)
     if keyword_result and keyword_result.get("score", 0) >= 0.6:
         keyword_result["search_time"] = time.time() - start_time
         return keyword_result
 
     # === Tier 3: Semantic match ===
-    semantic_result = semantic_match(question)
-    if semantic_result and semantic_result.get("score", 0) >= 0.6:
-        semantic_result["search_time"] = time.time() - start_time
-        return semantic_result
-
-    # Tier 4: Stack Overflow FIRST for coding questions
-    print("Trying Stack Overflow...")
-    so = live_stackoverflow_fallback(question)
-    if so:
-        so["search_time"] = time.time() - start_time
-        return so
-
-    # Tier 5: GitHub code search
-    print("Trying GitHub code...")
-    github = live_github_code_fallback(question)
-    if github:
-        github["search_time"] = time.time() - start_time
-        return github
-
-    # Tier 6: Wikipedia (now safer with relevance check)
-    print("Trying Wikipedia...")
-    wiki = live_wikipedia_fallback(question)
-    if wiki:
-        wiki["search_time"] = time.time() - start_time
-        return wiki
-
-    # Tier 7: arXiv (research)
-    print("Trying arXiv...")
-    arxiv = live_arxiv_fallback(question)
-    if arxiv:
-        arxiv["search_time"] = time.time() - start_time
-        return arxiv
-
-    # Tier 8: Reddit
-    print("Trying Reddit...")
-    reddit = live_reddit_fallback(question)
-    if reddit:
-        reddit["search_time"] = time.time() - start_time
-        return reddit
-
-    # Tier 9: YouTube
-    print("Trying YouTube...")
-    yt = live_youtube_fallback(question)
-    if yt:
-        yt["search_time"] = time.time() - start_time
-        return yt
+    if deadline - time.time() >= SEMANTIC_MIN_BUDGET:
+        semantic_result = await _semantic_match_async(question, deadline, cut_tiers)
+        if semantic_result and semantic_result.get("score", 0) >= 0.6:
+            semantic_result["search_time"] = time.time() - start_time
+            return semantic_result
+    else:
+        cut_tiers.append("semantic")
+
+    # Tiers 4-9: live sources, run concurrently but chosen in priority order
+    live = await _find_live_answer(question, deadline, cut_tiers)
+    if live:
+        live["search_time"] = time.time() - start_time
+        live["cut_tiers"] = cut_tiers
+        return live
 
     return {
         "text": None,
         "score": 0,
         "search_time": time.time() - start_time,
         "method": "none",
-        "confidence": "low"
+        "confidence": "low",
+        "cut_tiers": cut_tiers
     }
 
-# ====================== INGESTION + HOT RELOAD ADDITIONS ======================
-# ---- Dedup index based on current knowledge.json ----
-text_hashes = set()
-for d in docs:
-    try:
-        h = hashlib.sha256(d.get("text", "").strip().encode("utf-8")).hexdigest()
-        text_hashes.add(h)
-    except Exception:
-        continue
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "256"))
+BATCH_LIVE_CONCURRENCY = int(os.environ.get("BATCH_LIVE_CONCURRENCY", "4"))
+# Questions of one batch that run their live tiers at the same time (each uses up to
+# len(LIVE_TIERS) live_tier_pool workers); 0 answers batches from the local tiers only
 
-def _text_hash(t: str) -> str:
-    return hashlib.sha256((t or "").strip().encode("utf-8")).hexdigest()
+def find_best_answers(questions: List[str], deadline: Optional[float] = None) -> Tuple[List[asyncio.Future], asyncio.Task]:
+    """
+    Batch version of find_best_answer. Returns one future per question (in order), resolved as
+    soon as that question is answered, plus the task driving the batch (cancel it to abandon).
+    Tiers run stage by stage over the whole batch: answer cache + exact per item, keyword for all
+    pending items in one retrieval_pool call, one encode + one FAISS search for every question
+    still open, then the live tiers of the remaining questions, BATCH_LIVE_CONCURRENCY at a time.
+    """
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() for _ in questions]
+    task = loop.create_task(_answer_batch(questions, deadline or _request_deadline(), futures))
+    return futures, task
 
-# ---- Atomic write helper ----
-def _atomic_write_json(path: str, data: List[Dict[str, Any]]):
-    tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, path)
+async def _answer_batch(questions: List[str], deadline: float, futures: List[asyncio.Future]):
+    start_time = time.time()
+    generation = index_generation.number
+    clean = [clean_question(q) for q in questions]
 
+    def resolve(i: int, result: Dict, cut_tiers: Optional[List[str]] = None):
+        result["search_time"] = time.time() - start_time
+        if cut_tiers is not None:
+            result["cut_tiers"] = cut_tiers
+        _remember_answer(generation, clean[i], result)
+        futures[i].set_result(result)
+
+    try:
+        # === Answer cache + Tier 1: Exact source/topic match ===
+        pending = []
+        for i, question in enumerate(questions):
+            cached = _cached_answer(generation, clean[i], start_time)
+            if cached is not None:
+                futures[i].set_result(cached)
+                continue
+            exact_result = exact_source_match(question)
+            if exact_result:
+                resolve(i, exact_result)
+                continue
+            pending.append(i)
+
+        # === Tier 2: Keyword match ===
+        if pending:
+            keyword_results = await _in_retrieval_pool(lambda: [keyword_match(questions[i]) for i in pending])
+            still_open = []
+            for i, keyword_result in zip(pending, keyword_results):
+                if keyword_result and keyword_result.get("score", 0) >= 0.6:
+                    resolve(i, keyword_result)
+                else:
+                    still_open.append(i)
+            pending = still_open
+
+        # === Tier 3: Semantic match (chunked encode + matrix search, within the deadline) ===
+        semantic_cut = set(pending)
+        if pending:
+            semantic_results, cut = await _in_retrieval_pool(semantic_match_batch, [questions[i] for i in pending], deadline)
+            semantic_cut = {pending[r] for r in cut}
+            still_open = []
+            for i, semantic_result in zip(pending, semantic_results):
+                if semantic_result and semantic_result.get("score", 0) >= 0.6:
+                    resolve(i, semantic_result)
+                else:
+                    still_open.append(i)
+            pending = still_open
+
+        # Tiers 4-9: live sources, a few open questions at a time so one batch cannot take
+        # over live_tier_pool
+        live_slots = asyncio.Semaphore(BATCH_LIVE_CONCURRENCY) if BATCH_LIVE_CONCURRENCY > 0 else None
+
+        async def live(i: int):
+            item_cut = ["semantic"] if i in semantic_cut else []
+            result = None
+            if live_slots is not None:
+                async with live_slots:
+                    result = await _find_live_answer(questions[i], deadline, item_cut)
+            resolve(i, result or {"text": None, "score": 0, "method": "none", "confidence": "low"}, item_cut)
+
+        await asyncio.gather(*(live(i) for i in pending))
+    except Exception as e:
+        print(f"Batch search error: {e}")
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+
+# ====================== INGESTION + HOT RELOAD ADDITIONS ======================
 # ---- Index updaters (reuse your logic) ----
 def _update_in_memory_indexes(new_items: List[Dict[str, str]]):
-    """Update source_index, topic_index, keyword_index and FAISS incrementally."""
-    global docs, source_index, topic_index, keyword_index, semantic_index
+    """Update source_index, topic_index, keyword_index and FAISS incrementally (as a new generation)."""
+    with _index_lock:
+        _update_in_memory_indexes_locked(new_items)
 
-    # 1) Append to in-memory docs
-    start_len = len(docs)
-    docs.extend(new_items)
+def _update_in_memory_indexes_locked(new_items: List[Dict[str, str]]):
+    _publish_generation(_next_generation(index_generation, new_items))
+    _maybe_upgrade_semantic_index()
 
-    # 2) Update keyword/source/topic indexes
+def _next_generation(gen: IndexGeneration, new_items: List[Dict[str, str]]) -> IndexGeneration:
+    """
+    `gen` with `new_items` appended. Every structure a reader might hold is left untouched: the
+    keyword tail and the map overlays are copied, docs only grows past the published n_docs, and
+    new vectors go into a fresh semantic chunk.
+    """
+    docs = gen.docs
+    start_len = gen.n_docs
+    if len(docs) > start_len:
+        del docs[start_len:]   # left over from an update that failed before publishing
+
+    # 1) Update keyword/source/topic indexes
+    keyword_index = gen.keyword_index.copy()
+    source_updates, topic_updates = {}, {}
     for idx, doc in enumerate(new_items, start=start_len):
         src = doc.get("source", "").lower()
-        source_index[src] = doc
+        source_updates[src] = idx
 
         # PATCH: use improved topic extraction for new items
         clean_topic = _extract_topic_from_source(src)
         if clean_topic:
-            topic_index[clean_topic] = doc
+            topic_updates[clean_topic] = idx
 
         # Keyword index
-        text = doc.get("text", "").lower()
-        words = set(re.findall(r'\b\w+\b', text))
-        for w in words:
-            if len(w) > 3:
-                keyword_index[w].append(idx)
+        keyword_index.add_document(idx, doc.get("text", ""))
 
-    # 3) Incremental FAISS add
-    try:
-        new_texts = [it["text"] for it in new_items if it.get("text")]
-        if new_texts:
-            new_embs = embedder.encode(new_texts, normalize_embeddings=True)
-            semantic_index.add(new_embs.astype("float32"))
-    except Exception as e:
-        print(f"⚠️ FAISS incremental add failed: {e}")
+    # 2) Append to in-memory docs (invisible to readers until the generation is published)
+    docs.extend(new_items)
+    n_docs = start_len + len(new_items)
+
+    # 3) Incremental FAISS add (while still loading, the startup loader catches up from semantic_docs).
+    #    Embeds the passages of every doc the semantic index is missing, so one failed add heals on the next.
+    chunks, semantic_docs = gen.semantic_chunks, gen.semantic_docs
+    if gen.semantic_base is not None:
+        offsets = gen.passage_offsets
+        del offsets[semantic_docs + 1:]   # left over from an add that failed before publishing
+        try:
+            passages = _doc_passages(docs, semantic_docs, n_docs, offsets)
+            if passages:
+                chunks = _add_semantic_chunk(chunks, _encode_texts(passages))
+            semantic_docs = n_docs
+        except Exception as e:
+            print(f"⚠️ FAISS incremental add failed: {e}")
+
+    return gen.next(
+        docs=docs, n_docs=n_docs, keyword_index=keyword_index,
+        source_index=gen.source_index.updated(source_updates), topic_index=gen.topic_index.updated(topic_updates),
+        semantic_chunks=chunks, semantic_docs=semantic_docs)
 
 def _append_items(items: List[Dict[str, str]], flush_every: int = 5000) -> int:
-    """Append deduped items to disk (knowledge.json) and update memory+FAISS."""
+    """Append deduped items to the document store and update memory+FAISS."""
     if not items:
         return 0
+    with _index_lock:
+        return _append_items_locked(items, flush_every)
 
+def _append_items_locked(items: List[Dict[str, str]], flush_every: int) -> int:
     unique = []
     added = 0
     for it in items:
@@ -778,32 +2681,282 @@ def _append_items(items: List[Dict[str, str]], flush_every: int = 5000) -> int:
 
         # Flush in chunks to avoid huge memory
         if len(unique) >= flush_every:
-            try:
-                with open(KNOWLEDGE_PATH, "r", encoding="utf-8") as f:
-                    current = json.load(f)
-            except Exception:
-                current = []
-            current.extend(unique)
-            _atomic_write_json(KNOWLEDGE_PATH, current)
-            _update_in_memory_indexes(unique)
+            _store_and_index_locked(unique)  # O(batch): appended to the store's write-ahead tail
             added += len(unique)
             unique = []
 
     # Final flush
     if unique:
-        try:
-            with open(KNOWLEDGE_PATH, "r", encoding="utf-8") as f:
-                current = json.load(f)
-        except Exception:
-            current = []
-        current.extend(unique)
-        _atomic_write_json(KNOWLEDGE_PATH, current)
-        _update_in_memory_indexes(unique)
+        _store_and_index_locked(unique)
         added += len(unique)
 
-    print(f"📥 Appended {added} new items to knowledge.json")
+    print(f"📥 Appended {added} new items to the knowledge store")
     return added
 
+def _store_and_index_locked(items: List[Dict[str, str]]):
+    """
+    Append items to the store and the indexes. Docs the enricher scripts appended to the store in
+    the meantime land in front of them, so those are indexed first (doc id == store position).
+    """
+    start = doc_store.append(items)
+    _index_store_range_locked(index_generation.n_docs, start)
+    _update_in_memory_indexes_locked(items)
+
+def _index_store_range_locked(start: int, stop: int):
+    if stop > start:
+        _index_loaded_docs(list(itertools.islice(doc_store.iter_docs(start=start), stop - start)))
+        print(f"📥 Indexed {stop - start} docs appended to the store by another process")
+
+def _catch_up_store():
+    """Index what other processes appended to the store (polled by the knowledge watcher)."""
+    doc_store.refresh()
+    start = index_generation.n_docs
+    if len(doc_store) <= start:
+        return
+    # Encode outside the index lock; docs our own writer appends meanwhile are handled under it
+    _warm_embeddings(list(doc_store.iter_docs(start=start)))
+    with _index_lock:
+        doc_store.refresh()
+        _index_store_range_locked(index_generation.n_docs, len(doc_store))
+
+# ---------------------- PATCH: write-behind ingestion ----------------------
+INGEST_QUEUE_MAX = int(os.environ.get("INGEST_QUEUE_MAX", "10000"))
+INGEST_BATCH_WINDOW_MS = float(os.environ.get("INGEST_BATCH_WINDOW_MS", "500"))
+INGEST_BATCH_MAX = 512
+
+class IngestQueue:
+    """
+    Bounded write-behind queue for docs found by the live tiers. A single writer thread collects
+    what arrives within INGEST_BATCH_WINDOW_MS (up to INGEST_BATCH_MAX docs), dedupes it and runs
+    one _append_items call (store append + keyword/FAISS update) for the whole batch, so requests
+    return their answer without waiting for encode/index work. When the queue is full new docs
+    are dropped (and counted) rather than blocking a request.
+    """
+    _STOP = object()
+
+    def __init__(self, maxsize: int, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def put(self, items: List[Dict[str, str]]) -> int:
+        """Queue docs for ingestion; returns how many were accepted."""
+        accepted = 0
+        for it in items:
+            try:
+                self._queue.put_nowait(it)
+                accepted += 1
+            except queue.Full:
+                self.dropped += 1
+        self.enqueued += accepted
+        if accepted and self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+                    self._thread.start()
+        return accepted
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            until = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = until - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = any(it is self._STOP for it in batch)
+            docs_batch = list({_text_hash(it.get("text", "")): it for it in batch if it is not self._STOP}.values())
+            try:
+                if docs_batch:
+                    # Docs found while the knowledge base is still loading wait for the store to open
+                    while not STARTUP_STATE["exact_ready"] and STARTUP_STATE["status"] != "failed":
+                        time.sleep(0.2)
+                    if STARTUP_STATE["exact_ready"]:
+                        self.written += _append_items(docs_batch)
+                        self.batches += 1
+            except Exception as e:
+                print(f"⚠️ Background ingestion failed for {len(docs_batch)} docs: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until everything queued so far is written and indexed."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout: float = 30.0):
+        """Flush pending docs and stop the writer (called on shutdown)."""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": self._queue.qsize(), "enqueued": self.enqueued, "written": self.written,
+                "dropped": self.dropped, "batches": self.batches}
+
+ingest_queue = IngestQueue(INGEST_QUEUE_MAX, INGEST_BATCH_WINDOW_MS, INGEST_BATCH_MAX)
+
+# ---------------------- PATCH: knowledge.json hot reload ----------------------
+KNOWLEDGE_WATCH_INTERVAL = float(os.environ.get("KNOWLEDGE_WATCH_INTERVAL", "10"))
+# Seconds between knowledge.json polls (0 disables the watcher; POST /admin/reload-knowledge still works)
+KNOWLEDGE_HASHES_PATH = os.path.join(KNOWLEDGE_STORE_DIR, "knowledge_hashes.npy")
+# Text hashes of the knowledge.json last applied: a doc that was in it and is gone now was removed,
+# while docs the live tiers added were never in it and survive reloads
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# When set, admin endpoints require a matching X-Admin-Token header; endpoints that read local
+# files are disabled until it is set
+
+_reload_lock = threading.Lock()
+RELOAD_STATE: Dict[str, Any] = {"reloads": 0, "last": None, "error": None}
+
+def reload_knowledge(path: str = KNOWLEDGE_PATH) -> Dict[str, Any]:
+    """
+    Bring the running indexes in line with `path` (rewritten by the enricher scripts) without a
+    restart: diff it against the corpus by text hash, embed only docs that are new, drop docs that
+    were removed from the file, and publish the result as one new index generation.
+    """
+    with _reload_lock:
+        started = time.time()
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        wanted: Dict[str, Dict[str, str]] = {}
+        for it in items:
+            t, s = it.get("text", ""), it.get("source", "")
+            if t and s:
+                wanted.setdefault(_text_hash(t), {"text": t, "source": s})
+
+        previous = set()
+        if os.path.exists(KNOWLEDGE_HASHES_PATH):
+            previous = {h.decode("ascii") for h in np.load(KNOWLEDGE_HASHES_PATH)}
+        removed = {h for h in previous if h not in wanted and h in text_hashes}
+        added = [doc for h, doc in wanted.items() if h not in text_hashes]
+
+        if removed:
+            _replace_corpus(removed, added)
+        elif added:
+            _warm_embeddings(added)
+            _append_items(added)
+
+        tmp = f"{KNOWLEDGE_HASHES_PATH}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.sort(np.asarray(list(wanted), dtype="S64")))
+        os.replace(tmp, KNOWLEDGE_HASHES_PATH)
+
+        summary = {"added": len(added), "removed": len(removed), "docs": index_generation.n_docs,
+                   "generation": index_generation.number, "seconds": round(time.time() - started, 2)}
+        RELOAD_STATE.update(reloads=RELOAD_STATE["reloads"] + 1, last=summary, error=None)
+        print(f"🔄 Reloaded {path}: +{len(added)} / -{len(removed)} docs ({summary['seconds']}s)")
+        return summary
+
+def _replace_corpus(removed: set, added: List[Dict[str, str]]):
+    """
+    Drop the docs whose text hash is in `removed` and append `added`. Removing renumbers docs, so
+    the indexes are rebuilt from a snapshot outside the index lock (kept docs reuse their vectors,
+    only `added` is encoded). Docs ingested meanwhile are caught up under the lock, where the
+    store is rewritten to match and the new generation is published.
+    """
+    global text_hashes
+    snapshot = index_generation
+    kept_ids = [i for i in range(snapshot.n_docs) if _text_hash(snapshot.docs[i].get("text", "")) not in removed]
+    corpus = [snapshot.docs[i] for i in kept_ids] + added
+    fields, hashes = _index_documents(corpus)
+    if snapshot.semantic_ready:
+        fields["semantic_base"], fields["passage_offsets"] = _reused_semantic_index(
+            snapshot, kept_ids + [-1] * len(added), [d["text"] for d in corpus])
+        fields["semantic_docs"] = len(corpus)
+    else:
+        fields["semantic_base"] = None
+
+    # The store stays locked until replace(): anything another process appended after this point
+    # would otherwise be dropped by the rewrite
+    with _index_lock, doc_store.locked():
+        _index_store_range_locked(index_generation.n_docs, len(doc_store))   # replace() must not lose them
+        current = index_generation
+        if current.docs is not snapshot.docs:
+            raise RuntimeError("corpus was replaced during the reload, try again")
+        late = [d for d in (current.docs[i] for i in range(snapshot.n_docs, current.n_docs))
+                if _text_hash(d.get("text", "")) not in removed and _text_hash(d.get("text", "")) not in hashes]
+        gen = _next_generation(current.next(**fields, semantic_chunks=()), late)
+        doc_store.replace(gen.docs)
+        text_hashes = hashes | {_text_hash(d.get("text", "")) for d in late}
+        _publish_generation(gen)
+    _maybe_upgrade_semantic_index()
+
+def _reused_semantic_index(snapshot: IndexGeneration, old_ids: List[int], texts: List[str]) -> Tuple[Any, array]:
+    """
+    Flat index over the passages of `texts`, with its passage offsets. Vectors come from the
+    embedding cache, else from the snapshot's semantic index (old_ids[i] >= 0, ascending); only
+    passages new to the corpus are encoded.
+    """
+    index = faiss.IndexFlatIP(snapshot.semantic_base.d)
+    offsets = array("q", [0])
+    old_offsets = snapshot.passage_offsets
+    for start in range(0, len(texts), EMBED_PROGRESS_CHUNK):
+        chunk, old_rows = [], []
+        for old_id, text in zip(old_ids[start:start + EMBED_PROGRESS_CHUNK], texts[start:start + EMBED_PROGRESS_CHUNK]):
+            parts = _split_passages(text)
+            chunk.extend(parts)
+            offsets.append(offsets[-1] + len(parts))
+            if 0 <= old_id < snapshot.semantic_docs and old_offsets[old_id + 1] - old_offsets[old_id] == len(parts):
+                old_rows.extend(range(old_offsets[old_id], old_offsets[old_id + 1]))
+            else:
+                old_rows.extend([-1] * len(parts))
+        old = np.asarray(old_rows, dtype="int64")
+        rows = np.asarray(embedding_cache.lookup([_text_hash(t) for t in chunk]), dtype="int64")
+        vectors = np.empty((len(chunk), index.d), dtype="float32")
+        cached = rows >= 0
+        reused = ~cached & (old >= 0)
+        fresh = ~(cached | reused)
+        if cached.any():
+            vectors[cached] = embedding_cache.take(rows[cached])
+        if reused.any():
+            vectors[reused] = _semantic_rows(snapshot, old[reused])
+        if fresh.any():
+            vectors[fresh] = _encode_texts([chunk[i] for i in np.flatnonzero(fresh)])
+        index.add(vectors)
+    return index, offsets
+
+def _watch_knowledge_file():
+    """
+    Poll knowledge.json and reload it when it changes. The enricher scripts rewrite it in place,
+    so a change is only applied once size and mtime held still for a whole interval.
+    Docs the scripts stream into the document store instead are indexed on every poll.
+    """
+    applied, seen = None, None   # the first poll diffs once, catching edits made while down
+    while True:
+        time.sleep(KNOWLEDGE_WATCH_INTERVAL)
+        try:
+            _catch_up_store()
+        except Exception as e:
+            print(f"⚠️ Indexing docs appended to the store failed, will retry: {e}")
+        try:
+            st = os.stat(KNOWLEDGE_PATH)
+        except OSError:
+            continue
+        stamp = (st.st_size, st.st_mtime_ns)
+        if stamp == applied:
+            continue
+        if stamp != seen:
+            seen = stamp
+            continue
+        try:
+            reload_knowledge(KNOWLEDGE_PATH)
+            applied = stamp
+        except Exception as e:
+            RELOAD_STATE["error"] = str(e)
+            print(f"⚠️ Knowledge reload failed, will retry: {e}")
+
 # ====================== INGEST FROM WIKIPEDIA (BATCH + SEARCH) ======================
 class WikiTitles(BaseModel):
     titles: List[str]
@@ -812,7 +2965,11 @@ class WikiTitles(BaseModel):
     formatversion: int = 2  # IMPROVEMENT: cleaner JSON structure from MediaWiki
 
 def _wiki_fetch_pages(titles_batch: List[str]) -> List[Dict[str, str]]:
-    """Fetch extracts+canonical URLs for a batch of titles. Returns [{text, source}] items."""
+    """
+    Fetch extracts+canonical URLs for a batch of titles. Returns [{text, source}] items.
+    Raises when the first request fails, so callers can tell an outage from pages without text;
+    a failure while following `continue` returns the pages fetched so far.
+    """
     API = "https://en.wikipedia.org/w/api.php"
     params = {
         "action": "query",
@@ -823,26 +2980,43 @@ def _wiki_fetch_pages(titles_batch: List[str]) -> List[Dict[str, str]]:
         "formatversion": 2,         # IMPROVEMENT: a bit cleaner
         "titles": "|".join(titles_batch),
     }
-    try:
-        r = HTTP.get(API, params=params, timeout=60)
-        # PATCH: Friendly handling of Wikipedia anti-abuse 403
-        if r.status_code == 403:
-            print("⚠️ Wikipedia returned 403. Check your User-Agent header and request volume. Retrying with small batch...")
-            # One retry: smaller batch size or a slight delay
-            time.sleep(1.0)
-            r = HTTP.get(API, params=params, timeout=60)
-        r.raise_for_status()
-    except requests.HTTPError as e:
-        print(f"❌ Wikipedia HTTP error: {e} - params={params}")
-        return []
-    except Exception as e:
-        print(f"❌ Wikipedia request error: {e}")
-        return []
+    # Full-page extracts come one page per response: follow `continue` until every page has one
+    pages: Dict[str, Dict[str, Any]] = {}
+    for _ in range(len(titles_batch) + 1):
+        try:
+            r = HTTP.get(API, params=params, timeout=_live_timeout(60))
+            # PATCH: Friendly handling of Wikipedia anti-abuse 403
+            if r.status_code == 403:
+                print("⚠️ Wikipedia returned 403. Check your User-Agent header and request volume. Retrying with small batch...")
+                # One retry after a short delay, only if the request budget covers delay + request
+                if _live_remaining() < 1.0 + LIVE_MIN_BUDGET:
+                    _live_call.cut = True   # no budget left for the back-off + retry: not a miss
+                else:
+                    time.sleep(1.0)
+                    r = HTTP.get(API, params=params, timeout=_live_timeout(60))
+            r.raise_for_status()
+        except requests.HTTPError as e:
+            print(f"❌ Wikipedia HTTP error: {e} - params={params}")
+            if not pages:
+                raise
+            break
+        except Exception as e:
+            print(f"❌ Wikipedia request error: {e}")
+            if not pages:
+                raise
+            break
+
+        data = r.json()
+        for p in data.get("query", {}).get("pages", []):
+            page = pages.setdefault(p.get("title", ""), p)
+            if p.get("extract"):
+                page["extract"] = p["extract"]
+        if "continue" not in data:
+            break
+        params = {**params, **data["continue"]}
 
-    data = r.json()
-    pages = data.get("query", {}).get("pages", [])
     items = []
-    for p in pages:
+    for p in pages.values():
         text = p.get("extract", "") or ""
         source = p.get("fullurl", "") or ""
         # Only append meaningful items
@@ -850,16 +3024,478 @@ def _wiki_fetch_pages(titles_batch: List[str]) -> List[Dict[str, str]]:
             items.append({"text": text, "source": source})
     return items
 
+WIKI_INGEST_WORKERS = int(os.environ.get("WIKI_INGEST_WORKERS", "4"))
+# Title batches fetched at once across all ingestion jobs (keeps us polite to the MediaWiki API)
+WIKI_INGEST_EMBED_BATCH = int(os.environ.get("WIKI_INGEST_EMBED_BATCH", "1024"))
+# Fetched docs are deduped, embedded and indexed this many at a time
+WIKI_INGEST_MAX_BATCH = 20
+# MediaWiki caps `titles` at 50 and extracts at 20 per request
+INGEST_JOBS_KEPT = 100
+
+wiki_ingest_pool = ThreadPoolExecutor(max_workers=WIKI_INGEST_WORKERS, thread_name_prefix="wiki-ingest")
+
+class IngestJob:
+    """Progress of one bulk ingestion job (read by GET /ingest/jobs/{id} while it runs)."""
+
+    def __init__(self, kind: str, total: Optional[int], unit: str = "titles"):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.unit = unit            # what `processed` counts: titles, dataset rows...
+        self.status = "queued"      # queued -> running -> done | failed
+        self.total = total          # None when unknown (streamed datasets)
+        self.processed = 0          # items read (or given up on)
+        self.offset: Optional[int] = None   # resumable position, for sources that have one
+        self.fetched = 0
+        self.added = 0
+        self.duplicates = 0
+        self.failed_batches = 0
+        self.skipped = 0            # items dropped as malformed, too short or not found
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.id, "kind": self.kind, "status": self.status, "error": self.error,
+            "total": self.total, "processed": self.processed, "fetched": self.fetched, "added": self.added,
+            "duplicates": self.duplicates, "failed_batches": self.failed_batches, "skipped": self.skipped,
+            "percent": (round(100.0 * self.processed / self.total, 1) if self.total else 100.0)
+                       if self.total is not None else None,
+            "offset": self.offset,
+            "elapsed": round(elapsed, 2),
+            f"{self.unit}_per_sec": round(self.processed / elapsed, 2) if elapsed else 0.0,
+            "docs_per_sec": round(self.added / elapsed, 2) if elapsed else 0.0,
+        }
 
-@app.post("/chat")
-async def chat(query: Query):
-    """Chat endpoint with confidence scoring for Laravel"""
-    print(f"\n📨 Question: '{query.question}'")
-    start_time = time.time()
-    
-    result = find_best_answer(query.question)
-    total_time = time.time() - start_time
-    
+ingest_jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+_ingest_jobs_lock = threading.Lock()
+
+def _register_job(job: IngestJob) -> IngestJob:
+    with _ingest_jobs_lock:
+        ingest_jobs[job.id] = job
+        while len(ingest_jobs) > INGEST_JOBS_KEPT:
+            ingest_jobs.popitem(last=False)
+    return job
+
+def _warm_embeddings(items: List[Dict[str, str]]):
+    """Encode docs outside the index lock, so appending them afterwards only looks vectors up."""
+    if not index_generation.semantic_ready:
+        return
+    for i in range(0, len(items), EMBED_PROGRESS_CHUNK):
+        _encode_texts([p for d in items[i:i + EMBED_PROGRESS_CHUNK] for p in _split_passages(d["text"])])
+
+def _start_job(job: IngestJob):
+    """Wait until the store and exact/keyword indexes are loaded, then mark the job running."""
+    while not STARTUP_STATE["exact_ready"] and STARTUP_STATE["status"] != "failed":
+        time.sleep(0.2)
+    if not STARTUP_STATE["exact_ready"]:
+        raise RuntimeError("knowledge base failed to load")
+    job.status, job.started_at = "running", time.time()
+
+def _ingest_chunk(job: IngestJob, items: List[Dict[str, str]]):
+    """Dedupe a chunk against text_hashes, embed it outside the index lock and append it in one go."""
+    fresh = list({_text_hash(d["text"]): d for d in items if _text_hash(d["text"]) not in text_hashes}.values())
+    job.duplicates += len(items) - len(fresh)
+    _warm_embeddings(fresh)
+    job.added += _append_items(fresh)
+
+def _run_wiki_ingest(job: IngestJob, titles: List[str], batch_size: int, pause: float):
+    """
+    Fetch `titles` in batches on wiki_ingest_pool and append them in WIKI_INGEST_EMBED_BATCH
+    chunks: deduped against text_hashes, embedded outside the index lock, then indexed with one
+    _append_items call each.
+    """
+    def fetch(batch: List[str]) -> Optional[List[Dict[str, str]]]:
+        try:
+            return _wiki_fetch_pages(batch)
+        except Exception:
+            return None   # counted as a failed batch
+        finally:
+            if pause > 0:
+                time.sleep(pause)   # per worker, between requests
+
+    try:
+        _start_job(job)
+
+        batches = iter([titles[i:i + batch_size] for i in range(0, len(titles), batch_size)])
+        pending: List[Dict[str, str]] = []
+        # At most 2 batches per worker in flight, so fetched pages never pile up behind indexing
+        window = deque((batch, wiki_ingest_pool.submit(fetch, batch))
+                       for batch in itertools.islice(batches, 2 * WIKI_INGEST_WORKERS))
+        while window:
+            batch, future = window.popleft()
+            items = future.result()
+            nxt = next(batches, None)
+            if nxt is not None:
+                window.append((nxt, wiki_ingest_pool.submit(fetch, nxt)))
+            if items is None:
+                job.failed_batches += 1
+                items = []
+            else:
+                job.skipped += max(0, len(batch) - len(items))   # titles without a page or text
+            job.processed += len(batch)
+            job.fetched += len(items)
+            pending.extend(items)
+            if len(pending) >= WIKI_INGEST_EMBED_BATCH:
+                _ingest_chunk(job, pending)
+                pending = []
+        _ingest_chunk(job, pending)
+        job.status = "done"
+    except Exception as e:
+        job.status, job.error = "failed", str(e)
+        print(f"⚠️ Wikipedia ingestion job {job.id} failed: {e}")
+    finally:
+        job.finished_at = time.time()
+        print(f"📚 Wikipedia ingestion job {job.id} {job.status}: {job.added} new docs from {job.processed} titles")
+
+
+# ====================== INGEST FROM HUGGING FACE DATASETS (STREAMING) ======================
+DATASET_INGEST_BATCH = int(os.environ.get("DATASET_INGEST_BATCH", "1024"))
+# Docs are deduped, embedded and appended this many at a time; no more than one chunk is held in memory
+DATASET_OFFSETS_PATH = os.path.join(KNOWLEDGE_STORE_DIR, "dataset_offsets.json")
+# Rows consumed per (dataset, config, split), so a rerun continues after what is already ingested
+INGEST_LOCAL_DIR = os.environ.get("INGEST_LOCAL_DIR", "ingest_data")
+# Local datasets/dumps can only be ingested from inside this directory (relative paths resolve here),
+# since whatever is ingested can be read back through /chat
+
+class DatasetIngest(BaseModel):
+    path: str                              # hub id (e.g. "wikimedia/wikipedia"), or dataset dir / data file in INGEST_LOCAL_DIR
+    name: Optional[str] = None             # dataset config, e.g. "20231101.en"
+    split: str = "train"
+    text_field: str = "text"
+    source_field: Optional[str] = None     # e.g. "url"; default "<source_prefix>-<row number>"
+    source_prefix: Optional[str] = None    # default: derived from path
+    max_rows: Optional[int] = None         # rows to consume in this run
+    resume: bool = True                    # start from the saved offset
+    batch_size: int = DATASET_INGEST_BATCH
+
+_HUB_DATASET_ID = re.compile(r"^[A-Za-z0-9][\w.-]*(/[A-Za-z0-9][\w.-]*)?$")
+_DATASET_FILE_BUILDERS = {"json": "json", "jsonl": "json", "csv": "csv", "parquet": "parquet", "txt": "text"}
+_dataset_offsets_lock = threading.Lock()
+_running_datasets: set = set()
+
+def _open_dataset(req: DatasetIngest):
+    """Streaming IterableDataset. Local dirs and files are read directly, so this works offline."""
+    if os.path.isfile(req.path):
+        ext = os.path.splitext(req.path[:-3] if req.path.endswith(".gz") else req.path)[1].lstrip(".").lower()
+        if ext not in _DATASET_FILE_BUILDERS:
+            raise ValueError(f"unsupported data file type: {req.path}")
+        return load_dataset(_DATASET_FILE_BUILDERS[ext], data_files=req.path, split=req.split, streaming=True)
+    return load_dataset(req.path, req.name, split=req.split, streaming=True)
+
+def _ingest_local_path(path: str) -> Optional[str]:
+    """
+    Real path of `path` inside INGEST_LOCAL_DIR (relative paths are taken from there), or None if
+    nothing exists there. Paths resolving outside the directory (absolute, `..`, symlinks) are refused.
+    """
+    root = os.path.realpath(INGEST_LOCAL_DIR)
+    real = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, real]) != root:
+        raise HTTPException(status_code=403, detail=f"local ingest paths must be inside INGEST_LOCAL_DIR ({INGEST_LOCAL_DIR})")
+    return real if os.path.exists(real) else None
+
+def _dataset_key(req: DatasetIngest) -> str:
+    path = os.path.realpath(req.path) if os.path.exists(req.path) else req.path
+    return f"{path}|{req.name or ''}|{req.split}"
+
+def _dataset_offsets() -> Dict[str, int]:
+    if not os.path.exists(DATASET_OFFSETS_PATH):
+        return {}
+    with open(DATASET_OFFSETS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_dataset_offset(key: str, offset: int):
+    with _dataset_offsets_lock:
+        offsets = _dataset_offsets()
+        offsets[key] = offset
+        tmp = f"{DATASET_OFFSETS_PATH}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(offsets, f, indent=2)
+        os.replace(tmp, DATASET_OFFSETS_PATH)
+
+def _run_dataset_ingest(job: IngestJob, req: DatasetIngest, key: str):
+    """
+    Stream a dataset into the store: rows are mapped to {text, source} and ingested in chunks of
+    batch_size docs (_ingest_chunk), and the row offset is saved after every chunk. The offset is
+    only saved once a chunk is in the store, so a crash re-reads at most one chunk, and its docs
+    are then dropped as duplicates.
+    """
+    prefix = req.source_prefix or re.sub(r"[^a-z0-9]+", "-", os.path.basename(req.path.rstrip("/")).lower()).strip("-")
+    batch_size = max(1, req.batch_size)
+    try:
+        _start_job(job)
+        start = _dataset_offsets().get(key, 0) if req.resume else 0
+        job.offset = start
+        rows = _open_dataset(req)
+        if start:
+            rows = rows.skip(start)
+        if req.max_rows is not None:
+            rows = rows.take(req.max_rows)
+
+        pending: List[Dict[str, str]] = []
+        for row in rows:
+            row_number = start + job.processed
+            job.processed += 1
+            text = row.get(req.text_field)
+            source = str(row.get(req.source_field) or "") if req.source_field else f"{prefix or 'dataset'}-{row_number}"
+            if isinstance(text, str) and text.strip() and source:
+                pending.append({"text": text.strip(), "source": source})
+                job.fetched += 1
+            if len(pending) >= batch_size:
+                _ingest_chunk(job, pending)
+                pending = []
+                job.offset = start + job.processed
+                _save_dataset_offset(key, job.offset)
+        _ingest_chunk(job, pending)
+        job.offset = start + job.processed
+        _save_dataset_offset(key, job.offset)
+        job.status = "done"
+    except Exception as e:
+        job.status, job.error = "failed", str(e)
+        print(f"⚠️ Dataset ingestion job {job.id} failed at row {job.offset}: {e}")
+    finally:
+        job.finished_at = time.time()
+        with _ingest_jobs_lock:
+            _running_datasets.discard(key)
+        print(f"📚 Dataset ingestion job {job.id} {job.status}: {job.added} new docs from {job.processed} rows")
+
+# ====================== INGEST FROM JSONL.GZ DUMPS (STREAMING) ======================
+WIKI_DUMP_PATH = os.environ.get("WIKI_DUMP_PATH", "wikipedia_docs.jsonl.gz")
+# One JSON object per line ({text, source} or {title, url, text}); gzip or plain; ingested at startup when it changes
+WIKI_DUMP_STATE_PATH = os.path.join(KNOWLEDGE_STORE_DIR, "dumps_ingested.json")
+# (size, mtime) of every dump already ingested
+DUMP_READ_BUFFER = 1 << 20
+DUMP_MIN_CHARS = 40
+DUMP_QUEUE_DEPTH = 4
+# Parsed chunks that may wait for the embedder; bounds memory when parsing outruns embedding
+DUMP_PROGRESS_EVERY = 10.0
+
+class DumpIngest(BaseModel):
+    path: str = WIKI_DUMP_PATH   # or a file inside INGEST_LOCAL_DIR
+    batch_size: int = WIKI_INGEST_EMBED_BATCH
+    min_chars: int = DUMP_MIN_CHARS
+
+_DUMP_CITATIONS = re.compile(r"\[\d+\]")
+_DUMP_SPACES = re.compile(r"[ \t\r\f\v]+")
+_DUMP_BLANK_LINES = re.compile(r"\n\s*\n+")
+_dump_state_lock = threading.Lock()
+_running_dumps: set = set()
+
+# Pipeline stages: each takes and returns an iterator, so the whole dump is never in memory.
+def _dump_lines(path: str) -> Iterator[bytes]:
+    """Decompress: raw lines of a .jsonl.gz (or plain .jsonl) file."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as raw, io.BufferedReader(raw, DUMP_READ_BUFFER) as f:
+        yield from f
+
+def _parse_dump_lines(lines: Iterable[bytes], job: IngestJob) -> Iterator[Dict[str, str]]:
+    """Parse: map each JSON line to {text, source}; the source falls back to url, then title."""
+    for line in lines:
+        job.processed += 1
+        try:
+            row = json.loads(line)
+            text, source = row.get("text"), row.get("source") or row.get("url")
+            if not source and row.get("title"):
+                source = "wikipedia-" + re.sub(r"\s+", "-", str(row["title"]).strip().lower())
+        except (ValueError, AttributeError):
+            text = source = None
+        if isinstance(text, str) and source:
+            yield {"text": text, "source": str(source)}
+        elif line.strip():
+            job.skipped += 1
+
+def _clean_dump_docs(docs: Iterable[Dict[str, str]], min_chars: int, job: IngestJob) -> Iterator[Dict[str, str]]:
+    """Clean: drop citation markers and runs of whitespace (paragraph breaks are kept), skip stubs."""
+    for d in docs:
+        text = _DUMP_BLANK_LINES.sub("\n\n", _DUMP_SPACES.sub(" ", _DUMP_CITATIONS.sub("", d["text"]))).strip()
+        if len(text) < min_chars:
+            job.skipped += 1
+            continue
+        yield {"text": text, "source": d["source"]}
+
+def _dedupe_dump_docs(docs: Iterable[Dict[str, str]], job: IngestJob) -> Iterator[Dict[str, str]]:
+    """Dedupe: drop docs already in the store (_ingest_chunk re-checks, as the store moves on meanwhile)."""
+    for d in docs:
+        if _text_hash(d["text"]) in text_hashes:
+            job.duplicates += 1
+        else:
+            yield d
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _run_dump_ingest(job: IngestJob, req: DumpIngest, key: str):
+    """
+    decompress -> parse -> clean -> dedupe -> batch run on a producer thread, which hands chunks to
+    this thread through a bounded queue. Embedding and indexing (_ingest_chunk) happen here, so
+    parsing the next chunk overlaps with encoding the current one.
+    """
+    chunks: "queue.Queue" = queue.Queue(maxsize=DUMP_QUEUE_DEPTH)
+    stop = threading.Event()
+    done = object()
+
+    def send(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False    # the consumer gave up
+
+    def produce():
+        try:
+            docs = _parse_dump_lines(_dump_lines(req.path), job)
+            docs = _dedupe_dump_docs(_clean_dump_docs(docs, req.min_chars, job), job)
+            for chunk in _batched(docs, max(1, req.batch_size)):
+                if not send(chunk):
+                    return
+            send(done)
+        except Exception as e:
+            send(e)
+
+    try:
+        _start_job(job)
+        threading.Thread(target=produce, name=f"dump-parse-{job.id[:8]}", daemon=True).start()
+        last_report = time.time()
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            job.fetched += len(chunk)
+            _ingest_chunk(job, chunk)
+            if time.time() - last_report >= DUMP_PROGRESS_EVERY:
+                last_report = time.time()
+                stats = job.to_dict()
+                print(f"📦 {req.path}: {job.processed} lines, {job.added} new docs "
+                      f"({stats['lines_per_sec']:.0f} lines/s, {stats['docs_per_sec']:.0f} docs/s)")
+        job.status = "done"
+        _mark_dump_ingested(key)
+    except Exception as e:
+        job.status, job.error = "failed", str(e)
+        print(f"⚠️ Dump ingestion job {job.id} failed after {job.processed} lines: {e}")
+    finally:
+        stop.set()
+        job.finished_at = time.time()
+        with _ingest_jobs_lock:
+            _running_dumps.discard(key)
+        stats = job.to_dict()
+        print(f"📚 Dump ingestion job {job.id} {job.status}: {job.added} new docs from {job.processed} lines "
+              f"in {stats['elapsed']:.1f}s ({stats['docs_per_sec']:.0f} docs/s)")
+
+def _dump_stamp(path: str) -> List[int]:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _ingested_dumps() -> Dict[str, List[int]]:
+    if not os.path.exists(WIKI_DUMP_STATE_PATH):
+        return {}
+    with open(WIKI_DUMP_STATE_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _mark_dump_ingested(key: str):
+    with _dump_state_lock:
+        state = _ingested_dumps()
+        state[key] = _dump_stamp(key)
+        tmp = f"{WIKI_DUMP_STATE_PATH}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, WIKI_DUMP_STATE_PATH)
+
+def _start_dump_ingest(req: DumpIngest) -> Optional[IngestJob]:
+    """Start a dump job in the background; None if that file is already being ingested."""
+    key = os.path.realpath(req.path)
+    with _ingest_jobs_lock:
+        if key in _running_dumps:
+            return None
+        _running_dumps.add(key)
+    job = _register_job(IngestJob("dump", None, unit="lines"))
+    threading.Thread(target=_run_dump_ingest, args=(job, req, key),
+                     name=f"dump-ingest-{job.id[:8]}", daemon=True).start()
+    return job
+
+def _ingest_dump_if_changed():
+    """Startup hook: ingest WIKI_DUMP_PATH unless this exact file (size, mtime) was ingested before."""
+    path = os.path.realpath(WIKI_DUMP_PATH)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    if _ingested_dumps().get(path) == _dump_stamp(path):
+        return
+    job = _start_dump_ingest(DumpIngest(path=path))
+    if job:
+        print(f"📦 Ingesting {WIKI_DUMP_PATH} in the background (job {job.id})")
+
+# ====================== STARTUP (BACKGROUND LOADING) ======================
+# Loading runs after the port is bound, so Laravel gets answers (or a clean fallback) during
+# deploys instead of connection errors. Exact/keyword tiers serve as soon as docs are indexed;
+# the semantic tier joins once the embedder and FAISS index are ready.
+STARTUP_STATE: Dict[str, Any] = {
+    "status": "loading",     # loading -> ready | failed
+    "stage": "pending",      # pending -> documents -> semantic -> done
+    "exact_ready": False,
+    "keyword_ready": False,
+    "semantic_ready": False,
+    "embedded": 0,
+    "embed_total": 0,
+    "started_at": None,
+    "ready_at": None,
+    "error": None,
+}
+
+def _load_knowledge_base():
+    """Full startup sequence; runs in a background thread from the app lifespan."""
+    STARTUP_STATE["started_at"] = time.time()
+    try:
+        STARTUP_STATE["stage"] = "documents"
+        with _index_lock:
+            bundled_semantic = _load_documents()
+        STARTUP_STATE["exact_ready"] = STARTUP_STATE["keyword_ready"] = True
+
+        STARTUP_STATE["stage"] = "semantic"
+        _load_semantic_index(bundled_semantic)
+        STARTUP_STATE["semantic_ready"] = True
+        _maybe_upgrade_semantic_index()
+        _ingest_dump_if_changed()
+        if KNOWLEDGE_WATCH_INTERVAL > 0:
+            threading.Thread(target=_watch_knowledge_file, name="knowledge-watcher", daemon=True).start()
+    except Exception as e:
+        STARTUP_STATE["status"], STARTUP_STATE["error"] = "failed", str(e)
+        print(f"❌ Startup failed: {e}")
+        raise
+
+    STARTUP_STATE["stage"], STARTUP_STATE["status"] = "done", "ready"
+    STARTUP_STATE["ready_at"] = time.time()
+
+    print("\n🎯 ===== ACCURATE RAG SEARCH READY ===== 🎯")
+    print(f"📡 Endpoint: http://127.0.0.1:8001")
+    print(f"📊 Knowledge: {index_generation.n_docs} entries")
+    print(f"⚡ Confidence threshold: 0.6")
+    print(f"🎯 Accuracy: High (exact + keyword + semantic matching)")
+    print(f"⏱️ Loaded in {STARTUP_STATE['ready_at'] - STARTUP_STATE['started_at']:.1f}s")
+    print("=" * 50)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=_load_knowledge_base, name="knowledge-loader", daemon=True).start()
+    yield
+    # Write out docs the live tiers found but the writer has not ingested yet
+    await asyncio.get_running_loop().run_in_executor(None, ingest_queue.close)
+
+app = FastAPI(lifespan=lifespan)
+# Creates the FastAPI application instance
+
+
+def _chat_response(result: Dict) -> Dict:
+    """/chat payload for one find_best_answer result (also used per item by /chat/batch)."""
     if result.get("text") and result.get("score", 0) >= 0.6:
         # Good match found
         source = result["source"]
@@ -877,7 +3513,8 @@ async def chat(query: Query):
             "confidence": confidence,
             "is_fallback": False,
             "method": result.get("method", "unknown"),
-            "source": result.get("source", "unknown")
+            "source": result.get("source", "unknown"),
+            "cut_tiers": result.get("cut_tiers", [])
         }
     else:
         # No good match found - return fallback
@@ -889,34 +3526,161 @@ async def chat(query: Query):
             "confidence": result.get("score", 0),
             "is_fallback": True,
             "method": result.get("method", "none"),
-            "source": "fallback"
+            "source": "fallback",
+            "cut_tiers": result.get("cut_tiers", [])
         }
 
-@app.post("/search")
-async def search(query: Query):
-    """Detailed search endpoint"""
-    result = find_best_answer(query.question)
-    
+def _search_response(question: str, result: Dict) -> Dict:
+    """/search payload for one find_best_answer result (also used per item by /search/batch)."""
     if result.get("text"):
         return {
-            "question": query.question,
+            "question": question,
             "found": True,
             "answer": result["text"],
             "source": result["source"],
             "score": result["score"],
             "method": result["method"],
             "confidence": result.get("confidence", "unknown"),
-            "is_fallback": False
+            "is_fallback": False,
+            "cut_tiers": result.get("cut_tiers", [])
         }
     else:
         return {
-            "question": query.question,
+            "question": question,
             "found": False,
             "score": 0,
             "is_fallback": True,
-            "message": "No relevant information found"
+            "message": "No relevant information found",
+            "cut_tiers": result.get("cut_tiers", [])
         }
 
+@app.post("/chat")
+async def chat(query: Query, x_request_deadline: Optional[float] = Header(None)):
+    """Chat endpoint with confidence scoring for Laravel"""
+    print(f"\n📨 Question: '{query.question}'")
+    result = await find_best_answer(query.question, _request_deadline(query.deadline, x_request_deadline))
+    return _chat_response(result)
+
+@app.post("/search")
+async def search(query: Query, x_request_deadline: Optional[float] = Header(None)):
+    """Detailed search endpoint"""
+    result = await find_best_answer(query.question, _request_deadline(query.deadline, x_request_deadline))
+    return _search_response(query.question, result)
+
+BATCH_DISCONNECT_POLL = 0.5
+# Seconds between client-disconnect checks while a non-streaming batch is running
+
+async def _batch_responses(batch: BatchQuery, request: Request, header_deadline: Optional[float], respond):
+    """Shared body of /chat/batch and /search/batch: JSON list, or NDJSON lines in question order."""
+    if len(batch.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    print(f"\n📨 Batch of {len(batch.questions)} questions")
+    futures, task = find_best_answers(batch.questions, _request_deadline(batch.deadline, header_deadline))
+
+    if not batch.stream:
+        results = asyncio.gather(*futures)
+        try:
+            while not (await asyncio.wait([results], timeout=BATCH_DISCONNECT_POLL))[0]:
+                if await request.is_disconnected():
+                    print(f"🔌 Client went away, abandoning batch of {len(batch.questions)} questions")
+                    return Response(status_code=499)
+        finally:
+            task.cancel()   # client went away (or the handler was cancelled): stop the remaining tiers
+        return {"results": [respond(q, r) for q, r in zip(batch.questions, results.result())]}
+
+    async def lines():
+        try:
+            for i, (question, future) in enumerate(zip(batch.questions, futures)):
+                yield json.dumps({"index": i, **respond(question, await future)}, ensure_ascii=False) + "\n"
+        finally:
+            task.cancel()   # client went away: stop the remaining tiers
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchQuery, request: Request, x_request_deadline: Optional[float] = Header(None)):
+    """/chat for many messages in one round-trip (e.g. back-filling chatbot_training suggestions)"""
+    return await _batch_responses(batch, request, x_request_deadline, lambda question, result: _chat_response(result))
+
+@app.post("/search/batch")
+async def search_batch(batch: BatchQuery, request: Request, x_request_deadline: Optional[float] = Header(None)):
+    """/search for many questions in one round-trip"""
+    return await _batch_responses(batch, request, x_request_deadline, _search_response)
+
+def _check_admin(x_admin_token: Optional[str], required: bool = False):
+    """Require the admin token; `required` endpoints (local files, bulk jobs) are off while none is configured."""
+    if required and not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="this endpoint is disabled until ADMIN_TOKEN is set")
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+@app.post("/admin/reload-knowledge")
+async def admin_reload_knowledge(x_admin_token: Optional[str] = Header(None)):
+    """Apply the current knowledge.json now (same as the file watcher, without waiting for it)."""
+    _check_admin(x_admin_token)
+    if STARTUP_STATE["status"] != "ready":
+        raise HTTPException(status_code=503, detail="knowledge base is still loading")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, reload_knowledge, KNOWLEDGE_PATH)
+    except (OSError, ValueError, RuntimeError) as e:
+        RELOAD_STATE["error"] = str(e)
+        raise HTTPException(status_code=409 if isinstance(e, RuntimeError) else 400, detail=str(e))
+
+@app.post("/ingest/wikipedia", status_code=202)
+async def ingest_wikipedia(req: WikiTitles, x_admin_token: Optional[str] = Header(None)):
+    """Start a background job that fetches and indexes Wikipedia articles by title."""
+    _check_admin(x_admin_token, required=True)
+    titles = list(dict.fromkeys(t.strip() for t in req.titles if t and t.strip()))
+    if not titles:
+        raise HTTPException(status_code=422, detail="no titles given")
+    batch_size = max(1, min(req.batch_size, WIKI_INGEST_MAX_BATCH))
+    job = _register_job(IngestJob("wikipedia", len(titles)))
+    threading.Thread(target=_run_wiki_ingest, args=(job, titles, batch_size, max(0.0, req.sleep)),
+                     name=f"wiki-ingest-{job.id[:8]}", daemon=True).start()
+    return {"job_id": job.id, "status": job.status, "total": job.total, "status_url": f"/ingest/jobs/{job.id}"}
+
+@app.post("/ingest/dataset", status_code=202)
+async def ingest_dataset(req: DatasetIngest, x_admin_token: Optional[str] = Header(None)):
+    """Start a background job that streams a Hugging Face dataset (hub or local) into the knowledge base."""
+    _check_admin(x_admin_token, required=True)
+    local = _ingest_local_path(req.path)
+    if local is not None:
+        req.path = local
+    elif os.path.exists(req.path) or not _HUB_DATASET_ID.match(req.path):
+        # load_dataset would read a local path outside INGEST_LOCAL_DIR
+        raise HTTPException(status_code=400, detail=f"not a hub dataset id or a path inside INGEST_LOCAL_DIR: {req.path}")
+    key = _dataset_key(req)
+    with _ingest_jobs_lock:
+        if key in _running_datasets:
+            raise HTTPException(status_code=409, detail="this dataset split is already being ingested")
+        _running_datasets.add(key)
+    job = _register_job(IngestJob("dataset", req.max_rows, unit="rows"))
+    threading.Thread(target=_run_dataset_ingest, args=(job, req, key),
+                     name=f"dataset-ingest-{job.id[:8]}", daemon=True).start()
+    return {"job_id": job.id, "status": job.status, "status_url": f"/ingest/jobs/{job.id}"}
+
+@app.post("/ingest/dump", status_code=202)
+async def ingest_dump(req: DumpIngest, x_admin_token: Optional[str] = Header(None)):
+    """Start a background job that streams a local .jsonl(.gz) dump into the knowledge base."""
+    _check_admin(x_admin_token, required=True)
+    if os.path.realpath(req.path) == os.path.realpath(WIKI_DUMP_PATH):
+        path = os.path.realpath(WIKI_DUMP_PATH) if os.path.exists(WIKI_DUMP_PATH) else None
+    else:
+        path = _ingest_local_path(req.path)   # anything else must be inside INGEST_LOCAL_DIR
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"no such dump: {req.path}")
+    req.path = path
+    job = _start_dump_ingest(req)
+    if job is None:
+        raise HTTPException(status_code=409, detail="this dump is already being ingested")
+    return {"job_id": job.id, "status": job.status, "status_url": f"/ingest/jobs/{job.id}"}
+
+@app.get("/ingest/jobs/{job_id}")
+async def ingest_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return job.to_dict()
+
 @app.get("/debug-match")
 async def debug_match(question: str):
     """Debug endpoint to see matching process"""
@@ -926,8 +3690,8 @@ async def debug_match(question: str):
     keywords = extract_keywords(question)
     
     exact = exact_source_match(question)
-    keyword = keyword_match(question)
-    semantic = semantic_match(question)
+    keyword = await _in_retrieval_pool(keyword_match, question)
+    semantic = await _semantic_match_async(question)
     
     return {
         "original_question": question,
@@ -948,17 +3712,45 @@ async def debug_match(question: str):
             "score": semantic.get("score") if semantic else 0,
             "source": semantic.get("source") if semantic else None
         },
-        "best_match": find_best_answer(question)
+        "best_match": await find_best_answer(question)
     }
 
 @app.get("/health")
 async def health():
+    gen = index_generation
+    tiers = {
+        "exact": STARTUP_STATE["exact_ready"],
+        "keyword": STARTUP_STATE["keyword_ready"],
+        "semantic": STARTUP_STATE["semantic_ready"],
+    }
+    embed_total = STARTUP_STATE["embed_total"]
     return {
-        "status": "ready",
-        "knowledge_entries": len(docs),
-        "search_methods": "exact + keyword + semantic",
+        "status": STARTUP_STATE["status"],
+        "stage": STARTUP_STATE["stage"],
+        "tiers": tiers,
+        "progress": {
+            "embedded": STARTUP_STATE["embedded"],
+            "embed_total": embed_total,
+            "percent": round(100.0 * STARTUP_STATE["embedded"] / embed_total, 1) if embed_total else
+                       (100.0 if tiers["semantic"] else 0.0),
+            "elapsed": round((STARTUP_STATE["ready_at"] or time.time()) - STARTUP_STATE["started_at"], 2)
+                       if STARTUP_STATE["started_at"] else 0.0,
+        },
+        "error": STARTUP_STATE["error"],
+        "knowledge_entries": gen.n_docs,
+        "search_methods": " + ".join(name for name, ready in tiers.items() if ready) or "none",
         "confidence_threshold": 0.6,
-        "keywords_indexed": len(keyword_index)
+        "request_deadline_seconds": REQUEST_DEADLINE_SECONDS,
+        "keywords_indexed": len(gen.keyword_index),
+        "keyword_index": gen.keyword_index.memory_stats(),
+        "semantic_index": _semantic_index_info(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "query_embedding_batcher": query_embed_batcher.stats(),
+        "answer_cache": {**answer_cache.stats(), "generation": gen.number},
+        "live_miss_cache": live_miss_cache.stats(),
+        "ingest_queue": ingest_queue.stats(),
+        "knowledge_reload": RELOAD_STATE,
+        "store": doc_store.stats() if doc_store is not None else None
     }
 
 # Warm up and test
@@ -975,15 +3767,19 @@ async def health():
 # print("Test Results:")
 # print("-" * 80)
 # for question, expected_min_score, note in test_cases:
-#     result = find_best_answer(question)
+#     result = asyncio.run(find_best_answer(question))
 #     score = result.get("score", 0)
 #     status = "✅ PASS" if score >= expected_min_score else "❌ FAIL"
 #     method = result.get("method", "none")
 #     print(f"{status} '{question[:40]}...' -> score: {score:.3f} (method: {method}) - {note}")
 
-print("\n🎯 ===== ACCURATE RAG SEARCH READY ===== 🎯")
-print(f"📡 Endpoint: http://127.0.0.1:8001")
-print(f"📊 Knowledge: {len(docs)} entries")
-print(f"⚡ Confidence threshold: 0.6")
-print(f"🎯 Accuracy: High (exact + keyword + semantic matching)")
-print("=" * 50)
\ No newline at end of file
+# Offline build step: `python main.py build-index [bundle_dir]`
+# BM25 scaling check: `python main.py bench-keyword [size ...]`
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench-keyword":
+        benchmark_keyword_search(tuple(int(s) for s in sys.argv[2:]) or (10_000, 100_000, 200_000))
+    if len(sys.argv) > 1 and sys.argv[1] == "build-index":
+        _load_knowledge_base()
+        if _semantic_upgrade_thread is not None:
+            _semantic_upgrade_thread.join()   # ship the ANN index in the bundle
+        build_index_bundle(sys.argv[2] if len(sys.argv) > 2 else INDEX_BUNDLE_DIR)
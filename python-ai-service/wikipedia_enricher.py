@@ -1,17 +1,241 @@
-import wikipediaapi
 import json
 import os
+import sqlite3
 import time
-from typing import List, Set
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
 import re
 
+import requests
+
+from doc_store import DocumentStore
+
+API_URL = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = 'MyChatbot/1.0 (contact@example.com)'
+KNOWLEDGE_STORE_DIR = os.environ.get("KNOWLEDGE_STORE_DIR", "knowledge_store")
+KNOWLEDGE_STORE_COMPRESS = os.environ.get("KNOWLEDGE_STORE_COMPRESS", "1") == "1"
+# Same store the service reads; it indexes what we append here without a restart
+
+TITLES_PER_REQUEST = 20       # MediaWiki returns at most 20 intro extracts per query
+REQUESTS_PER_SECOND = float(os.environ.get("WIKI_REQUESTS_PER_SECOND", "3"))
+FETCH_WORKERS = int(os.environ.get("WIKI_FETCH_WORKERS", "4"))
+MAXLAG = 5                    # ask the API to refuse us while its replicas are lagging
+CRAWL_FRONTIER_PATH = os.environ.get("WIKI_CRAWL_DB", "wiki_crawl.sqlite")
+LINK_RESPONSES_MAX = 5        # `continue` pages of links read per batch (links come alphabetically)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests/second on average, bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold every caller back for `seconds` (the server asked us to back off)."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+def _retry_after(response: requests.Response, default: float) -> float:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), else `default`."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class MediaWikiClient:
+    """
+    MediaWiki API client shared by all fetch threads. Every request takes a token from one
+    TokenBucket; 429/503 responses and `maxlag` errors pause the whole bucket for Retry-After.
+    """
+
+    def __init__(self, bucket: TokenBucket, max_retries: int = 5):
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": USER_AGENT})
+
+    def query(self, **params) -> Dict:
+        params = {"action": "query", "format": "json", "formatversion": 2, "maxlag": MAXLAG, **params}
+        for attempt in range(self.max_retries + 1):
+            backoff = min(60.0, 2.0 ** attempt)
+            self.bucket.acquire()
+            try:
+                r = self.session.get(API_URL, params=params, timeout=30)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"⚠️ MediaWiki request failed ({e}), retrying in {backoff:.0f}s")
+                self.bucket.pause(backoff)
+                continue
+            if r.status_code in (429, 503):
+                self.bucket.pause(_retry_after(r, backoff))
+                continue
+            r.raise_for_status()
+            data = r.json()
+            error = data.get("error")
+            if error:
+                if error.get("code") == "maxlag":
+                    self.bucket.pause(_retry_after(r, 5.0))
+                    continue
+                raise RuntimeError(f"MediaWiki error {error.get('code')}: {error.get('info')}")
+            return data
+        raise RuntimeError(f"MediaWiki API still throttling after {self.max_retries} retries")
+
+    def query_all(self, **params):
+        """Yield every response of a query, following `continue`."""
+        while True:
+            data = self.query(**params)
+            yield data
+            if "continue" not in data:
+                return
+            params = {**params, **data["continue"]}
+
+    def intro_extracts(self, titles: List[str]) -> Dict[str, str]:
+        """Plain-text intro of each title that exists (keys are the titles as requested)."""
+        extracts: Dict[str, str] = {}
+        renamed: Dict[str, str] = {}
+        for data in self.query_all(prop="extracts", exintro=1, explaintext=1, exlimit="max",
+                                   redirects=1, titles="|".join(titles)):
+            query = data.get("query", {})
+            for hop in query.get("normalized", []) + query.get("redirects", []):
+                renamed[hop["from"]] = hop["to"]
+            for page in query.get("pages", []):
+                if page.get("extract"):
+                    extracts[page["title"]] = page["extract"]
+        return _by_requested_title(titles, renamed, extracts)
+
+    def page_links(self, titles: List[str]) -> Dict[str, List[str]]:
+        """Article links of each title (keys are the titles as requested)."""
+        links: Dict[str, List[str]] = {}
+        renamed: Dict[str, str] = {}
+        responses = self.query_all(prop="links", plnamespace=0, pllimit="max", redirects=1, titles="|".join(titles))
+        for _, data in zip(range(LINK_RESPONSES_MAX), responses):
+            query = data.get("query", {})
+            for hop in query.get("normalized", []) + query.get("redirects", []):
+                renamed[hop["from"]] = hop["to"]
+            for page in query.get("pages", []):
+                links.setdefault(page["title"], []).extend(link["title"] for link in page.get("links", []))
+        return _by_requested_title(titles, renamed, links)
+
+    def category_members(self, category: str, limit: int = 20) -> List[str]:
+        data = self.query(list="categorymembers", cmtitle=category, cmnamespace=0, cmlimit=limit)
+        return [m["title"] for m in data.get("query", {}).get("categorymembers", [])]
+
+
+def _by_requested_title(titles: List[str], renamed: Dict[str, str], values: Dict) -> Dict:
+    """Map API results (keyed by normalized/redirect-resolved title) back to the requested titles."""
+    result = {}
+    for title in titles:
+        final, hops = title, 0
+        while final in renamed and hops < 5:
+            final, hops = renamed[final], hops + 1
+        if final in values:
+            result[title] = values[final]
+    return result
+
+
+_SKIP_LINK = re.compile(r"^(List of|Lists of|Index of|Outline of|Glossary of|Timeline of)\b|\(disambiguation\)$|^\d{1,4}( BC| AD)?$")
+
+def _link_priority(link: str, parent: str) -> float:
+    """
+    How worth crawling a link is (0 = never): topical overlap with the linking page's title,
+    with a small bonus for short, specific titles. List/index/disambiguation/year pages are skipped.
+    """
+    if _SKIP_LINK.search(link):
+        return 0.0
+    words = set(re.findall(r"[a-z]+", link.lower()))
+    if not words:
+        return 0.0
+    overlap = len(words & set(re.findall(r"[a-z]+", parent.lower()))) / len(words)
+    return 1.0 + 2.0 * overlap + 1.0 / len(words)
+
+
+class CrawlFrontier:
+    """
+    Persistent BFS frontier (SQLite): one row per discovered title with its depth, accumulated
+    priority and state (queued / done / failed). Pages are handed out by depth, then priority.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pages (
+            title TEXT PRIMARY KEY, depth INTEGER NOT NULL, priority REAL NOT NULL DEFAULT 0,
+            state TEXT NOT NULL DEFAULT 'queued')""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_queue ON pages (state, depth, priority)")
+        self.db.commit()
+
+    def seed(self, titles: Iterable[str]):
+        """Queue start topics at depth 0 (known titles keep their state, so reruns resume; failed ones are retried)."""
+        with self.db:
+            self.db.execute("UPDATE pages SET state = 'queued' WHERE state = 'failed'")
+            self.db.executemany("INSERT OR IGNORE INTO pages (title, depth, priority) VALUES (?, 0, 0)",
+                                [(t,) for t in titles])
+
+    def next_batch(self, limit: int) -> List[Tuple[str, int]]:
+        return self.db.execute("SELECT title, depth FROM pages WHERE state = 'queued' "
+                               "ORDER BY depth, priority DESC LIMIT ?", (limit,)).fetchall()
+
+    def checkpoint(self, done: List[str], failed: List[str], links: List[Tuple[str, int, float]]):
+        """Record a processed batch and the links it found, atomically."""
+        with self.db:
+            self.db.executemany("UPDATE pages SET state = 'done' WHERE title = ?", [(t,) for t in done])
+            self.db.executemany("UPDATE pages SET state = 'failed' WHERE title = ?", [(t,) for t in failed])
+            self.db.executemany(
+                "INSERT INTO pages (title, depth, priority) VALUES (?, ?, ?) "
+                "ON CONFLICT (title) DO UPDATE SET priority = priority + excluded.priority "
+                "WHERE state = 'queued'", links)
+
+    def done_count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM pages WHERE state = 'done'").fetchone()[0]
+
+    def queued_count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM pages WHERE state = 'queued'").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
 class WikipediaEnricher:
-    def __init__(self):
-        self.wiki = wikipediaapi.Wikipedia(
-            user_agent='MyChatbot/1.0 (contact@example.com)',
-            language='en',
-            extract_format=wikipediaapi.ExtractFormat.WIKI
-        )
+    def __init__(self, workers: int = FETCH_WORKERS, requests_per_second: float = REQUESTS_PER_SECOND,
+                 store_dir: str = KNOWLEDGE_STORE_DIR):
+        self.client = MediaWikiClient(TokenBucket(requests_per_second))
+        self.workers = workers
+        self.store = DocumentStore(store_dir, compress=KNOWLEDGE_STORE_COMPRESS)
+        self._existing_sources: Optional[Set[str]] = None
         self.added_count = 0
         self.error_count = 0
     
@@ -286,54 +510,77 @@ class WikipediaEnricher:
             text = '. '.join(result) + '...'
         return text.strip()
     
+    def known_sources(self) -> Set[str]:
+        """Sources already in the document store or knowledge.json (read once per run)."""
+        if self._existing_sources is None:
+            sources = {doc.get("source", "") for doc in self.store.iter_docs()}
+            if os.path.exists("knowledge.json"):
+                with open("knowledge.json", "r", encoding="utf-8") as f:
+                    sources.update(item.get("source", "") for item in json.load(f))
+            self._existing_sources = sources
+        return self._existing_sources
+
     def enrich_from_list(self, topics: List[str], max_articles: int = 1500) -> int:
-        """Enrich from a list of topics"""
-        if os.path.exists("knowledge.json"):
-            with open("knowledge.json", "r", encoding="utf-8") as f:
-                knowledge_base = json.load(f)
-        else:
-            knowledge_base = []
-        
-        existing_sources = {item['source'] for item in knowledge_base}
-        added = 0
-        
+        """
+        Enrich from a list of topics: TITLES_PER_REQUEST intros per API call, fetched by
+        `workers` threads under the shared rate limit, each batch appended to the store as it
+        arrives. Stops once `max_articles` were added by this call.
+        """
+        existing_sources = self.known_sources()
+        todo = {}
         for topic in topics:
-            if self.added_count >= max_articles:
-                break
-                
             source_id = f"wikipedia-{topic.replace(' ', '-').replace('_', '-').lower()}"
-            if source_id in existing_sources:
-                continue
-            
-            print(f"Fetching: {topic}")
-            page = self.wiki.page(topic)
-            
-            if page.exists() and page.summary:
+            if source_id not in existing_sources and source_id not in todo.values():
+                todo[topic] = source_id
+        batches = iter([list(todo)[i:i + TITLES_PER_REQUEST] for i in range(0, len(todo), TITLES_PER_REQUEST)])
+        added = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # A couple of batches per worker in flight: enough to keep the bucket busy, little
+            # wasted once max_articles is reached
+            window = deque()
+            def submit_next():
+                batch = next(batches, None)
+                if batch is not None:
+                    window.append((batch, pool.submit(self.client.intro_extracts, batch)))
+            for _ in range(2 * self.workers):
+                submit_next()
+
+            while window:
+                batch, future = window.popleft()
+                if added < max_articles:
+                    submit_next()
                 try:
-                    summary = self.clean_text(page.summary, 400)
-                    
-                    knowledge_base.append({
-                        "text": summary,
-                        "source": source_id
-                    })
-                    
-                    existing_sources.add(source_id)
-                    self.added_count += 1
-                    added += 1
-                    
-                    print(f"✓ Added: {topic}")
-                    time.sleep(0.5)  # Be nice to Wikipedia API
-                    
+                    extracts = future.result()
                 except Exception as e:
-                    print(f"✗ Error processing {topic}: {e}")
-                    self.error_count += 1
-            else:
-                print(f"✗ Not found: {topic}")
-        
-        # Save after each batch
-        with open("knowledge.json", "w", encoding="utf-8") as f:
-            json.dump(knowledge_base, f, indent=2, ensure_ascii=False)
-        
+                    print(f"✗ Error fetching {len(batch)} topics ({batch[0]}...): {e}")
+                    self.error_count += len(batch)
+                    continue
+                if added >= max_articles:
+                    continue
+
+                new_docs = []
+                for topic in batch:
+                    if topic not in extracts:
+                        print(f"✗ Not found: {topic}")
+                        continue
+                    if added + len(new_docs) >= max_articles:
+                        break
+                    try:
+                        summary = self.clean_text(extracts[topic], 400)
+                    except Exception as e:
+                        print(f"✗ Error processing {topic}: {e}")
+                        self.error_count += 1
+                        continue
+                    new_docs.append({"text": summary, "source": todo[topic]})
+                    existing_sources.add(todo[topic])
+                    print(f"✓ Added: {topic}")
+
+                # Stream each batch into the store; the running service indexes it on its next poll
+                self.store.append(new_docs)
+                added += len(new_docs)
+                self.added_count += len(new_docs)
+
         return added
     
     def enrich_knowledge_comprehensive(self, max_total: int = 1500):
@@ -350,71 +597,108 @@ class WikipediaEnricher:
         # Try to get more from categories
         if self.added_count < max_total:
             print("\nPhase 2: Exploring Wikipedia categories...")
-            categories = self.get_wikipedia_categories()
-            
-            for category in categories:
-                if self.added_count >= max_total:
-                    break
-                    
-                print(f"Exploring category: {category}")
-                cat_page = self.wiki.page(category)
-                
-                if cat_page.exists() and hasattr(cat_page, 'categorymembers'):
-                    # Get first 20 members of this category
-                    members = list(cat_page.categorymembers.values())[:20]
-                    member_titles = [m.title for m in members]
-                    
-                    added = self.enrich_from_list(member_titles, max_total - self.added_count)
-                    print(f"  Added {added} from {category}")
-                    time.sleep(1)  # Longer delay between categories
+            categories = list(dict.fromkeys(self.get_wikipedia_categories()))
+
+            # Members of every category are listed concurrently, then fetched like any topic list
+            def members(category: str) -> List[str]:
+                try:
+                    return self.client.category_members(category, limit=20)   # first 20 members
+                except Exception as e:
+                    print(f"✗ Error exploring {category}: {e}")
+                    self.error_count += 1
+                    return []
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                member_lists = list(pool.map(members, categories))
+            for category, titles in zip(categories, member_lists):
+                print(f"Exploring category: {category} ({len(titles)} articles)")
+
+            added = self.enrich_from_list([t for titles in member_lists for t in titles], max_total - self.added_count)
+            print(f"  Added {added} from {len(categories)} categories")
+
+        # Crawl links with what is left of max_total (every crawled page adds at most one doc)
+        if self.added_count < max_total:
+            print("\nPhase 3: Crawling linked topics...")
+            self.enrich_more_topics(max_pages=max_total - self.added_count)
         
         print(f"\n=== ENRICHMENT COMPLETE ===")
         print(f"Total articles added: {self.added_count}")
         print(f"Total errors: {self.error_count}")
-        
-        if os.path.exists("knowledge.json"):
-            with open("knowledge.json", "r", encoding="utf-8") as f:
-                final_kb = json.load(f)
-            print(f"Final knowledge base size: {len(final_kb)} entries")
-        self.enrich_more_topics()
+        print(f"Final knowledge base size: {len(self.store)} entries")
         return self.added_count
 
     # ====================== EXTENDED ENRICHER ======================
 
-    wiki = wikipediaapi.Wikipedia(
-            user_agent='MyChatbot/1.0 (contact@example.com)',
-            language='en',
-            extract_format=wikipediaapi.ExtractFormat.WIKI
-    )
+    def enrich_more_topics(self, start_topics: Optional[List[str]] = None, depth: int = 2,
+                           fanout: Sequence[int] = (10, 5), max_pages: Optional[int] = None,
+                           frontier_path: str = CRAWL_FRONTIER_PATH) -> int:
+        """
+        Breadth-first crawl from `start_topics` (default: additional_topics) along page links.
 
-    def enrich_more_topics(start_topics: List[str], depth: int = 2) -> List[dict]:
-        """Recursive fetch: Start from topics, get linked pages"""
-        new_docs = []
-        visited = set()
-        
-        def fetch_recursive(topic: str, current_depth: int):
-            if current_depth > depth or topic in visited:
-                return
-            visited.add(topic)
-            
-            try:
-                page = wiki.page(topic)
-                if page.exists():
-                    text = page.text[:2000]  # Limit size
-                    source = f"wikipedia-{topic.lower().replace(' ', '-')}"
-                    new_docs.append({"text": text, "source": source})
-                    
-                    # Get links for recursion
-                    links = list(page.links.keys())[:10]  # Top 10 links
-                    for link in links:
-                        fetch_recursive(link, current_depth + 1)
-            except Exception as e:
-                print(f"Error fetching {topic}: {e}")
-        
-        for start in start_topics:
-            fetch_recursive(start, 0)
-        
-        return new_docs
+        The frontier lives in SQLite (`frontier_path`): every batch of pages is fetched, its docs
+        appended to the store, its links queued and the batch marked done in one transaction, so
+        an interrupted run resumes exactly where it stopped when called again. A page at depth d
+        queues its `fanout[d]` best links (last value for deeper levels), ranked by _link_priority;
+        links found from several pages accumulate priority. `max_pages` caps the pages crawled
+        over all runs of the same frontier. Returns the number of docs added.
+        """
+        start_topics = self.additional_topics if start_topics is None else start_topics
+        known = self.known_sources()
+        frontier = CrawlFrontier(frontier_path)
+        frontier.seed(start_topics)
+        added = 0
+        try:
+            while max_pages is None or frontier.done_count() < max_pages:
+                limit = TITLES_PER_REQUEST * self.workers
+                if max_pages is not None:
+                    limit = min(limit, max_pages - frontier.done_count())
+                pending = frontier.next_batch(limit)
+                if not pending:
+                    break
+                batches = [pending[i:i + TITLES_PER_REQUEST] for i in range(0, len(pending), TITLES_PER_REQUEST)]
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    results = list(pool.map(lambda batch: self._crawl_batch(batch, depth), batches))
+
+                new_docs, links, failed = [], [], []
+                for batch, (extracts, page_links, error) in zip(batches, results):
+                    if error is not None:
+                        print(f"✗ Error fetching {len(batch)} pages ({batch[0][0]}...): {error}")
+                        self.error_count += len(batch)
+                        failed.extend(title for title, _ in batch)
+                        continue
+                    for title, level in batch:
+                        source = f"wikipedia-{title.lower().replace(' ', '-')}"
+                        if title in extracts and source not in known:
+                            new_docs.append({"text": self.clean_text(extracts[title], 2000), "source": source})
+                            known.add(source)
+                        if level < depth:
+                            cap = fanout[min(level, len(fanout) - 1)]
+                            scored = [(link, _link_priority(link, title)) for link in page_links.get(title, [])]
+                            scored = sorted((item for item in scored if item[1] > 0), key=lambda item: -item[1])
+                            links.extend((link, level + 1, score) for link, score in scored[:cap])
+
+                # Docs first, then the checkpoint: a crash in between re-fetches this batch on
+                # resume, and the docs already written are skipped by source
+                self.store.append(new_docs)
+                frontier.checkpoint(done=[title for batch in batches for title, _ in batch if title not in failed],
+                                    failed=failed, links=links)
+                added += len(new_docs)
+                self.added_count += len(new_docs)
+                print(f"🕸️ Crawled {frontier.done_count()} pages, {frontier.queued_count()} queued, "
+                      f"+{len(new_docs)} docs")
+        finally:
+            frontier.close()
+        return added
+
+    def _crawl_batch(self, batch: List[Tuple[str, int]], depth: int):
+        """(intro extracts, links of pages above max depth, error) for one batch of (title, depth)."""
+        try:
+            titles = [title for title, _ in batch]
+            extracts = self.client.intro_extracts(titles)
+            expand = [title for title, level in batch if level < depth and title in extracts]
+            return extracts, (self.client.page_links(expand) if expand else {}), None
+        except Exception as e:
+            return {}, {}, e
 
     # Usage: Add to your main enrich function
     additional_topics = [
@@ -616,25 +900,6 @@ class WikipediaEnricher:
         "Zoology"
     ]
 
-    #additional_topics = ["Artificial Intelligence", "Quantum Computing", "Renewable Energy"]  # Expand list
-    new_entries = enrich_more_topics(additional_topics, depth=2)
-
-    # Append to existing knowledge.json
-    if os.path.exists("knowledge.json"):
-        with open("knowledge.json", "r") as f:
-            existing = json.load(f)
-    else:
-        existing = []
-
-    # Avoid duplicates by source
-    existing_sources = {d["source"] for d in existing}
-    updated = existing + [d for d in new_entries if d["source"] not in existing_sources]
-
-    with open("knowledge.json", "w") as f:
-        json.dump(updated, f, indent=2)
-
-    print(f"Added {len(new_entries)} new entries. Total now: {len(updated)}")
-
 
 def backup_knowledge():
     """Create a backup of knowledge.json"""
@@ -653,4 +918,4 @@ if __name__ == "__main__":
     # Run enrichment
     enricher = WikipediaEnricher()
     enricher.enrich_knowledge_comprehensive(max_total=1500)
-    # enricher.enrich_more_topics()
\ No newline at end of file
+    # enricher.enrich_more_topics(depth=2)   # resumable: rerun to continue an interrupted crawl
\ No newline at end of file